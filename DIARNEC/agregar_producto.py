@@ -1,28 +1,79 @@
 # agregar_producto.py
-import sqlite3
+import argparse
+import csv
 
-DB_PATH = "distribuidora.db"
+from database import get_db_connection
+
+# Mismo texto SQL en cada llamada: sqlite3 reutiliza el statement ya preparado
+# (cache de statements de la conexión) y solo vuelve a bindear parámetros.
+_INSERT_PRODUCTO_SQL = """
+    INSERT INTO productos (nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
 
 def insertar_producto(nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO productos (nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima))
-    conn.commit()
-    conn.close()
-    print("Producto insertado OK")
+    conn = get_db_connection()
+    with conn:  # commit si sale bien, rollback si falla (p.ej. constraint)
+        conn.execute(_INSERT_PRODUCTO_SQL, (nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima))
+
+def insertar_productos(rows):
+    """
+    Carga masiva: rows es una lista de tuplas
+    (nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima).
+    Todo va en una sola transacción (un solo commit/fsync para el lote).
+    Devuelve la cantidad de filas insertadas.
+    """
+    conn = get_db_connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(_INSERT_PRODUCTO_SQL, rows)
+    return len(rows)
+
+# columnas esperadas en el CSV de --bulk (con encabezado)
+_COLUMNAS_CSV = ("nombre", "marca", "categoria_id", "precio_compra", "precio_venta", "cantidad", "cantidad_minima")
+
+def _parse_producto(nombre, marca, cat, precio_compra, precio_venta, cantidad, cm):
+    """Convierte los campos de texto (input o CSV) a la tupla que espera el INSERT."""
+    nombre = nombre.strip()
+    marca = marca.strip() or None
+    cat = cat.strip()
+    cm = cm.strip()
+    return (
+        nombre,
+        marca,
+        int(cat) if cat else None,
+        float(precio_compra.strip()),
+        float(precio_venta.strip()),
+        int(cantidad.strip()),
+        int(cm) if cm else 0,
+    )
+
+def _leer_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            _parse_producto(*((r.get(c) or "") for c in _COLUMNAS_CSV))
+            for r in csv.DictReader(f)
+        ]
 
 if __name__ == "__main__":
-    nombre = input("Nombre: ").strip()
-    marca = input("Marca (opcional): ").strip() or None
-    cat = input("Categoria ID (enter si no): ").strip()
-    categoria_id = int(cat) if cat else None
-    precio_compra = float(input("Precio compra: ").strip())
-    precio_venta = float(input("Precio venta: ").strip())
-    cantidad = int(input("Cantidad inicial: ").strip())
-    cm = input("Cantidad mínima (enter=0): ").strip()
-    cantidad_minima = int(cm) if cm else 0
-
-    insertar_producto(nombre, marca, categoria_id, precio_compra, precio_venta, cantidad, cantidad_minima)
+    parser = argparse.ArgumentParser(description="Alta de productos")
+    parser.add_argument(
+        "--bulk", metavar="archivo.csv",
+        help="carga masiva desde CSV con encabezado: " + ",".join(_COLUMNAS_CSV),
+    )
+    args = parser.parse_args()
+
+    if args.bulk:
+        n = insertar_productos(_leer_csv(args.bulk))
+        print(f"{n} productos insertados OK")
+    else:
+        insertar_producto(*_parse_producto(
+            input("Nombre: "),
+            input("Marca (opcional): "),
+            input("Categoria ID (enter si no): "),
+            input("Precio compra: "),
+            input("Precio venta: "),
+            input("Cantidad inicial: "),
+            input("Cantidad mínima (enter=0): "),
+        ))
+        print("Producto insertado OK")
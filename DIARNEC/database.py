@@ -1,135 +1,248 @@
+import atexit
 import sqlite3
+import threading
+import weakref
 
 DB_PATH = 'distribuidora.db'
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# Versión del esquema que deja init_db (se guarda en PRAGMA user_version).
+# Subirla cada vez que se agregue una tabla/columna/índice abajo.
+SCHEMA_VERSION = 4
+
+# Tablas base. Solo CREATE ... IF NOT EXISTS: las columnas que faltan en BDs
+# viejas se agregan por migración en init_db.
+_SCHEMA_DDL = """
+CREATE TABLE IF NOT EXISTS categorias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS productos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre TEXT NOT NULL,
+    -- columnas nuevas se agregan por migración en init_db
+    categoria_id INTEGER,
+    cantidad INTEGER NOT NULL DEFAULT 0,
+    -- cantidad_minima puede faltar en BDs viejas, se migra en init_db
+    FOREIGN KEY (categoria_id) REFERENCES categorias(id)
+);
+
+CREATE TABLE IF NOT EXISTS ventas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cliente TEXT NOT NULL,
+    total REAL NOT NULL,
+    fecha TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ventas_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    venta_id INTEGER NOT NULL,
+    producto_id INTEGER NOT NULL,
+    cantidad INTEGER NOT NULL,
+    precio REAL NOT NULL,
+    FOREIGN KEY (venta_id) REFERENCES ventas(id),
+    FOREIGN KEY (producto_id) REFERENCES productos(id)
+);
+
+CREATE TABLE IF NOT EXISTS devoluciones (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    venta_id INTEGER NOT NULL,
+    producto_id INTEGER NOT NULL,
+    cantidad INTEGER NOT NULL,
+    motivo TEXT,
+    fecha TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pagos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    monto REAL NOT NULL,
+    descripcion TEXT,
+    referencia TEXT,
+    fecha TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS proveedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pagos_proveedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    proveedor_id INTEGER NOT NULL,
+    monto REAL NOT NULL,
+    descripcion TEXT,
+    fecha TEXT NOT NULL,
+    FOREIGN KEY (proveedor_id) REFERENCES proveedores(id)
+);
+
+CREATE TABLE IF NOT EXISTS movimientos_stock (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    producto_id INTEGER NOT NULL,
+    cantidad INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    proveedor_id INTEGER,
+    fecha_vencimiento TEXT,
+    lote TEXT,
+    fecha TEXT NOT NULL,
+    FOREIGN KEY (producto_id) REFERENCES productos(id),
+    FOREIGN KEY (proveedor_id) REFERENCES proveedores(id)
+);
+
+CREATE TABLE IF NOT EXISTS vendedores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    nombre TEXT NOT NULL,
+    telefono TEXT,
+    email TEXT
+    -- comision puede faltar en BDs viejas, se migra en init_db
+);
+
+CREATE TABLE IF NOT EXISTS gastos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tipo TEXT NOT NULL,
+    monto REAL NOT NULL,
+    descripcion TEXT,
+    fecha TEXT NOT NULL
+);
+"""
+
+# Columnas que pueden faltar en BDs viejas: (tabla, (col_def, ...))
+# col_def: "nombre_de_columna TIPO DEFAULT x"
+# (pagos_proveedores y movimientos_stock no necesitan: ya traen todo)
+_MIGRACIONES_COLS = (
+    ('productos', ('marca TEXT', 'precio_compra REAL', 'precio_venta REAL', 'cantidad_minima INTEGER DEFAULT 0')),
+    ('vendedores', ('comision REAL DEFAULT 0',)),
+)
+
+# PRAGMAs por conexión (no persisten en el archivo, hay que aplicarlos en cada connect)
+_PRAGMAS_CONEXION = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",      # ~64 MB de caché de páginas
+    "PRAGMA mmap_size=268435456",    # 256 MB
+    "PRAGMA busy_timeout=30000",     # con WAL el único lock que se espera es el del otro escritor
+)
+
+class _ConexionCompartida(sqlite3.Connection):
+    """
+    Conexión reutilizada por hilo. close() no la cierra: solo descarta lo
+    que no se confirmó, así los llamadores pueden seguir usando el patrón
+    get_db_connection() / try / finally: conn.close() sin cambios.
+    """
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def _cerrar(self):
+        # re-ANALYZE incremental de lo que quedó desactualizado; cuesta microsegundos
+        try:
+            self.execute("PRAGMA optimize")
+        finally:
+            super().close()
+
+# Cada hilo guarda su conexión en _local; _abiertas solo tiene referencias
+# débiles (para cerrarlas al salir). Cuando un hilo termina (el servidor
+# threaded de werkzeug usa un hilo por request) su conexión se libera y sqlite
+# cierra el archivo, en vez de quedar abierta hasta el fin del proceso.
+_local = threading.local()
+_abiertas = weakref.WeakSet()
+_abiertas_lock = threading.Lock()
+
+def get_db_connection(dict_rows=False):
+    """
+    Devuelve la conexión del hilo. Por defecto las filas son tuplas (más
+    livianas); dict_rows=True da sqlite3.Row para acceso por nombre.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # cached_statements: la app tiene unos 150 SQL distintos (más variantes de
+        # filtros/UPDATE); con 512 entran todos y ninguno se vuelve a preparar
+        conn = sqlite3.connect(
+            DB_PATH, factory=_ConexionCompartida, check_same_thread=False, cached_statements=512
+        )
+        for pragma in _PRAGMAS_CONEXION:
+            conn.execute(pragma)
+        _local.conn = conn
+        with _abiertas_lock:
+            _abiertas.add(conn)
+    conn.row_factory = sqlite3.Row if dict_rows else None
     return conn
 
+@atexit.register
+def _cerrar_conexiones():
+    with _abiertas_lock:
+        for conn in list(_abiertas):
+            try:
+                conn._cerrar()
+            except sqlite3.Error:
+                pass
+        _abiertas.clear()
+
 def _cols(conn, table):
     cur = conn.execute(f"PRAGMA table_info({table})")
-    return {row["name"] for row in cur.fetchall()}
+    return {row[1] for row in cur.fetchall()}  # (cid, name, type, ...)
 
-def _add_col_if_missing(conn, table, col_def):
+def _add_col_if_missing(conn, table, col_def, cols=None):
     # col_def: "nombre_de_columna TIPO DEFAULT x"
+    # cols: set de columnas ya leído con _cols(); se actualiza si se agrega la columna
     col_name = col_def.split()[0]
-    if col_name not in _cols(conn, table):
+    if cols is None:
+        cols = _cols(conn, table)
+    if col_name not in cols:
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {col_def}")
+        cols.add(col_name)
 
 def init_db():
-    """Crea la base de datos y tablas si no existen y MIGRA columnas faltantes."""
+    """
+    Crea la base de datos y tablas si no existen y MIGRA columnas faltantes.
+    Si la BD ya está en SCHEMA_VERSION no hace nada.
+    """
     conn = get_db_connection()
+    # arranque en caliente: una sola lectura del header y listo
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
     cur = conn.cursor()
 
-    # Tablas base
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS categorias (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS productos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        -- columnas nuevas se agregan por migración abajo
-        categoria_id INTEGER,
-        cantidad INTEGER NOT NULL DEFAULT 0,
-        -- cantidad_minima puede faltar en BDs viejas, se migra abajo
-        FOREIGN KEY (categoria_id) REFERENCES categorias(id)
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS ventas (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        cliente TEXT NOT NULL,
-        total REAL NOT NULL,
-        fecha TEXT NOT NULL
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS ventas_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        venta_id INTEGER NOT NULL,
-        producto_id INTEGER NOT NULL,
-        cantidad INTEGER NOT NULL,
-        precio REAL NOT NULL,
-        FOREIGN KEY (venta_id) REFERENCES ventas(id),
-        FOREIGN KEY (producto_id) REFERENCES productos(id)
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS devoluciones (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        venta_id INTEGER NOT NULL,
-        producto_id INTEGER NOT NULL,
-        cantidad INTEGER NOT NULL,
-        motivo TEXT,
-        fecha TEXT NOT NULL
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS pagos (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        tipo TEXT NOT NULL,
-        monto REAL NOT NULL,
-        descripcion TEXT,
-        referencia TEXT,
-        fecha TEXT NOT NULL
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS proveedores (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS pagos_proveedores (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        proveedor_id INTEGER NOT NULL,
-        monto REAL NOT NULL,
-        descripcion TEXT,
-        fecha TEXT NOT NULL,
-        FOREIGN KEY (proveedor_id) REFERENCES proveedores(id)
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS movimientos_stock (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        producto_id INTEGER NOT NULL,
-        cantidad INTEGER NOT NULL,
-        tipo TEXT NOT NULL,
-        proveedor_id INTEGER,
-        fecha_vencimiento TEXT,
-        lote TEXT,
-        fecha TEXT NOT NULL,
-        FOREIGN KEY (producto_id) REFERENCES productos(id),
-        FOREIGN KEY (proveedor_id) REFERENCES proveedores(id)
-    )''')
-
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS vendedores (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nombre TEXT NOT NULL,
-        telefono TEXT,
-        email TEXT
-        -- comision puede faltar en BDs viejas, se migra abajo
-    )''')
-
-    # ===== MIGRACIONES (agregar columnas faltantes sin perder datos) =====
-    # productos: marca, precio_compra, precio_venta, cantidad_minima
-    _add_col_if_missing(conn, 'productos', 'marca TEXT')
-    _add_col_if_missing(conn, 'productos', 'precio_compra REAL')
-    _add_col_if_missing(conn, 'productos', 'precio_venta REAL')
-    _add_col_if_missing(conn, 'productos', 'cantidad_minima INTEGER DEFAULT 0')
+    # WAL es persistente en el archivo: alcanza con fijarlo acá una vez.
+    # Con WAL los lectores no bloquean al escritor y cada commit hace un solo fsync.
+    if DB_PATH != ':memory:':
+        cur.execute("PRAGMA journal_mode=WAL")
 
-    # vendedores: comision
-    _add_col_if_missing(conn, 'vendedores', 'comision REAL DEFAULT 0')
+    # Tablas base (todo el DDL en un solo executescript)
+    conn.executescript(_SCHEMA_DDL)
 
-    # (opcional) pagos_proveedores: en caso de querer defaults, no necesario
-    # movimientos_stock ya tiene lote y fecha_vencimiento
-
-    conn.commit()
+    # ===== MIGRACIONES (agregar columnas faltantes sin perder datos) =====
+    # Una sola transacción para todos los ALTER + índices + user_version:
+    # un solo fsync, y si algo falla la versión no queda marcada.
+    with conn:
+        conn.execute("BEGIN")
+        for table, col_defs in _MIGRACIONES_COLS:
+            cols = _cols(conn, table)
+            for col_def in col_defs:
+                _add_col_if_missing(conn, table, col_def, cols)
+
+        # ===== ÍNDICES (columnas FK usadas en JOINs/lookups) =====
+        # (venta_id, producto_id) también sirve para lookups solo por venta_id
+        cur.execute("DROP INDEX IF EXISTS idx_ventas_items_venta")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_items_venta_producto ON ventas_items(venta_id, producto_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_items_producto ON ventas_items(producto_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_devoluciones_venta ON devoluciones(venta_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_devoluciones_producto ON devoluciones(producto_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_stock_producto ON movimientos_stock(producto_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_stock_proveedor ON movimientos_stock(proveedor_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_proveedores_proveedor ON pagos_proveedores(proveedor_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_productos_categoria ON productos(categoria_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_productos_nombre ON productos(nombre)")
+        # filtros por fecha del dashboard y join vendedor -> ventas (ventas.cliente = vendedores.nombre)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_fecha ON ventas(fecha)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_ventas_cliente ON ventas(cliente)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_gastos_fecha ON gastos(fecha)")
+        # listados ORDER BY nombre / ORDER BY fecha DESC, id DESC
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_vendedores_nombre ON vendedores(nombre)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pagos_proveedores_fecha ON pagos_proveedores(fecha)")
+
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    # estadísticas para el planner (tablas/índices nuevos)
+    cur.execute("ANALYZE")
     conn.close()
@@ -1,8 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response, g, session
 from datetime import datetime, timedelta
 import sqlite3
 from io import StringIO
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice, zip_longest
+import hashlib
+import json
+import os
+import threading
+import time
 from database import init_db, get_db_connection
 from pdf_generator import generate_invoice_pdf, generate_price_list_pdf
 
@@ -12,6 +21,73 @@ app.secret_key = 'distribuidora_secret_key'
 # Alias de transferencia para mostrar en la factura (pie de página)
 ALIAS_TRANSFERENCIA = "DIARNEC.DISTRIBUIDORA.ALIAS"
 
+# ---------- Conexión por request ----------
+def get_db():
+    """
+    Conexión del request actual. Todas las vistas (y ensure_schema) comparten
+    la misma; el teardown descarta lo que haya quedado sin confirmar.
+    """
+    if "db" not in g:
+        g.db = get_db_connection(dict_rows=True)
+    return g.db
+
+@app.teardown_request
+def _liberar_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        conn.close()
+
+# ---------- Números del form ----------
+# Los inputs aceptan coma decimal; vacío/None da el default. Un valor inválido
+# levanta ValueError como float()/int(), y cada vista decide qué hacer.
+def _to_float(s, default=0.0):
+    if not s:
+        return default
+    return float(s.replace(',', '.') if ',' in s else s)
+
+def _to_int(s, default=0):
+    if not s:
+        return default
+    return int(s)
+
+def _to_float_o_cero(s):
+    # montos opcionales del form: lo que no se pueda leer cuenta como 0
+    try:
+        return _to_float(s)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _to_int_campo(val, field_name):
+    # enteros obligatorios del form ('3', '3.0', '3,0'); el mensaje va al flash
+    raw = (val or '').strip()
+    if not raw:
+        raise ValueError(f'Falta el campo: {field_name}')
+    try:
+        return int(_to_float(raw))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Valor inválido en "{field_name}": {raw}')
+
+# ---------- Textos del form ----------
+def _form_textos(*nombres):
+    """Los campos pedidos del form, sin espacios ('' si faltan), en ese orden."""
+    form = request.form
+    return tuple((form.get(n) or '').strip() for n in nombres)
+
+# UPDATE de las vistas *_update: solo las columnas que llegaron en el form.
+# Hay pocas combinaciones por tabla, así que el SQL se arma una vez por combinación.
+@lru_cache(maxsize=64)
+def _update_sql(tabla, cols):
+    return f"UPDATE {tabla} SET {', '.join(c + ' = ?' for c in cols)} WHERE id = ?"
+
+# INSERT ... RETURNING id existe desde SQLite 3.35; antes, lastrowid
+_HAY_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def _insertar(conn, sql, params):
+    """Ejecuta un INSERT de una fila y devuelve el id generado."""
+    if _HAY_RETURNING:
+        return conn.execute(sql + " RETURNING id", params).fetchone()[0]
+    return conn.execute(sql, params).lastrowid
+
 # ---------- Helpers de migración ligera ----------
 def _table_cols(conn, table):
     rows = conn.execute(f"PRAGMA table_info({table})").fetchall()
@@ -20,11 +96,14 @@ def _table_cols(conn, table):
     except Exception:
         return {r[1] for r in rows}
 
-def _add_col_if_missing(conn, table, col_def):
+def _add_col_if_missing(conn, table, col_def, cols=None):
+    # cols: set de _table_cols() ya leído; se actualiza si se agrega la columna
     col_name = col_def.split()[0]
-    cols = _table_cols(conn, table)
+    if cols is None:
+        cols = _table_cols(conn, table)
     if col_name not in cols:
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {col_def}")
+        cols.add(col_name)
 
 def ensure_schema():
     """
@@ -33,21 +112,27 @@ def ensure_schema():
     comisiones por marca, pagos/bonificaciones, devoluciones (cab/items)
     y saldos por vendedor.
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # productos
-        _add_col_if_missing(conn, "productos", "marca TEXT")
-        _add_col_if_missing(conn, "productos", "precio_compra REAL")
-        _add_col_if_missing(conn, "productos", "precio_venta REAL")
-        _add_col_if_missing(conn, "productos", "cantidad_minima INTEGER DEFAULT 0")
+        cols = _table_cols(conn, "productos")
+        _add_col_if_missing(conn, "productos", "marca TEXT", cols)
+        _add_col_if_missing(conn, "productos", "precio_compra REAL", cols)
+        _add_col_if_missing(conn, "productos", "precio_venta REAL", cols)
+        _add_col_if_missing(conn, "productos", "cantidad_minima INTEGER DEFAULT 0", cols)
+
+        # ventas: datos de la factura, que se genera recién al descargarla
+        _add_col_if_missing(conn, "ventas", "factura_snapshot TEXT")
 
         # vendedores
-        _add_col_if_missing(conn, "vendedores", "comision REAL DEFAULT 0")
-        _add_col_if_missing(conn, "vendedores", "telefono TEXT")
+        cols = _table_cols(conn, "vendedores")
+        _add_col_if_missing(conn, "vendedores", "comision REAL DEFAULT 0", cols)
+        _add_col_if_missing(conn, "vendedores", "telefono TEXT", cols)
 
         # movimientos_stock (para FEFO)
-        _add_col_if_missing(conn, "movimientos_stock", "cantidad_restante INTEGER")
-        _add_col_if_missing(conn, "movimientos_stock", "entrada_id INTEGER")
+        cols = _table_cols(conn, "movimientos_stock")
+        _add_col_if_missing(conn, "movimientos_stock", "cantidad_restante INTEGER", cols)
+        _add_col_if_missing(conn, "movimientos_stock", "entrada_id INTEGER", cols)
 
         # backfill de cantidad_restante
         conn.execute("""
@@ -69,8 +154,9 @@ def ensure_schema():
                 fecha TEXT
             )
         """)
-        _add_col_if_missing(conn, "pagos_proveedores", "proveedor_id INTEGER")
-        _add_col_if_missing(conn, "pagos_proveedores", "monto REAL")
+        cols = _table_cols(conn, "pagos_proveedores")
+        _add_col_if_missing(conn, "pagos_proveedores", "proveedor_id INTEGER", cols)
+        _add_col_if_missing(conn, "pagos_proveedores", "monto REAL", cols)
 
         # comisiones por vendedor y marca
         conn.execute("""
@@ -143,56 +229,189 @@ def ensure_schema():
             )
         """)
 
+        # índices: lotes FEFO (producto + tipo + vencimiento) y filtros por fecha
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ms_fefo
+                ON movimientos_stock(producto_id, tipo, fecha_vencimiento, cantidad_restante)
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_dc_fecha ON devoluciones_cab(fecha)")
+        # vencimientos: índice parcial con el mismo predicado que las alertas/inventario
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ms_venc
+                ON movimientos_stock(fecha_vencimiento)
+             WHERE tipo = 'entrada' AND fecha_vencimiento IS NOT NULL
+        """)
+        # ítems por devolución (borrado / detalle) y movimientos por vendedor y por fecha.
+        # (comisiones_vendedor_marca ya tiene el índice de su UNIQUE(vendedor_id, marca);
+        #  los listados ORDER BY fecha DESC, id DESC usan los índices de fecha, que llevan el rowid)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_di_devolucion ON devoluciones_items(devolucion_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_di_producto ON devoluciones_items(producto_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pv_vendedor ON pagos_vendedores(vendedor_id, fecha)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pv_fecha ON pagos_vendedores(fecha)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_bonif_vendedor ON bonificaciones(vendedor_id, fecha)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_bonif_fecha ON bonificaciones(fecha)")
+
+        # borrar un vendedor arrastra sus comisiones, pagos y bonificaciones
+        # (ON DELETE CASCADE sin reconstruir las tablas ni prender foreign_keys)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS vendedores_ad AFTER DELETE ON vendedores BEGIN
+                DELETE FROM comisiones_vendedor_marca WHERE vendedor_id = old.id;
+                DELETE FROM pagos_vendedores          WHERE vendedor_id = old.id;
+                DELETE FROM bonificaciones            WHERE vendedor_id = old.id;
+            END
+        """)
+
+        # búsqueda del inventario: FTS5 con tokenizer trigram (subcadenas, como el
+        # LIKE '%q%'), sincronizado con productos por triggers
+        _crear_productos_fts(conn)
+
         conn.commit()
     finally:
         conn.close()
 
+# FTS5 (trigram) sobre productos(nombre, marca); si el SQLite no lo trae, el
+# inventario sigue buscando con LIKE
+_INV_FTS = False
+
+_PRODUCTOS_FTS_DDL = (
+    """CREATE VIRTUAL TABLE productos_fts USING fts5(
+           nombre, marca, content='productos', content_rowid='id', tokenize='trigram'
+       )""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+           INSERT INTO productos_fts(rowid, nombre, marca) VALUES (new.id, new.nombre, new.marca);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+           INSERT INTO productos_fts(productos_fts, rowid, nombre, marca) VALUES ('delete', old.id, old.nombre, old.marca);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF nombre, marca ON productos BEGIN
+           INSERT INTO productos_fts(productos_fts, rowid, nombre, marca) VALUES ('delete', old.id, old.nombre, old.marca);
+           INSERT INTO productos_fts(rowid, nombre, marca) VALUES (new.id, new.nombre, new.marca);
+       END""",
+)
+
+def _crear_productos_fts(conn):
+    global _INV_FTS
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'productos_fts'"
+    ).fetchone()
+    if not existe:
+        try:
+            for stmt in _PRODUCTOS_FTS_DDL:
+                conn.execute(stmt)
+            # indexa lo que ya había
+            conn.execute("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            # sin fts5/trigram: se deshace lo que se haya creado y queda el LIKE
+            conn.execute("DROP TABLE IF EXISTS productos_fts")
+            for t in ("productos_fts_ai", "productos_fts_ad", "productos_fts_au"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {t}")
+            return
+    _INV_FTS = True
+
 def _norm_marca(s):
     return (s or '').strip().upper()
 
-def _get_comision_pct(conn, vendedor_id, marca):
-    """Comisión % para vendedor+marca; fallback a comisión base del vendedor; luego 0."""
-    marca_norm = _norm_marca(marca)
+_COMISIONES_VENDEDOR_SQL = """
+    SELECT 1 AS es_marca, marca, comision_pct FROM comisiones_vendedor_marca WHERE vendedor_id = ?
+    UNION ALL
+    SELECT 0, NULL, comision FROM vendedores WHERE id = ?
+"""
+
+def _comisiones_vendedor(conn, vendedor_id):
+    """
+    Comisiones del vendedor leídas de una vez: ({marca_norm: pct}, comisión base).
+    Sirve para resolver todos los ítems de una venta/devolución sin una consulta por ítem.
+    """
+    por_marca = {}
+    base = 0.0
     if vendedor_id:
-        r = conn.execute(
-            "SELECT comision_pct FROM comisiones_vendedor_marca WHERE vendedor_id=? AND marca=?",
-            (vendedor_id, marca_norm)
-        ).fetchone()
-        if r and r["comision_pct"] is not None:
-            try:
-                return float(r["comision_pct"])
-            except Exception:
-                pass
-        v = conn.execute("SELECT comision FROM vendedores WHERE id = ?", (vendedor_id,)).fetchone()
-        if v and v["comision"] is not None:
+        # reglas por marca + comisión base en un solo round trip (es_marca=0 -> base)
+        for es_marca, marca, pct in conn.execute(_COMISIONES_VENDEDOR_SQL, (vendedor_id, vendedor_id)):
+            if pct is None:
+                continue
             try:
-                return float(v["comision"])
+                pct = float(pct)
             except Exception:
-                pass
-    return 0.0
+                continue
+            if es_marca:
+                por_marca[marca] = pct
+            else:
+                base = pct
+    return por_marca, base
+
+def _get_comision_pct(conn, vendedor_id, marca, comisiones=None):
+    """
+    Comisión % para vendedor+marca; fallback a comisión base del vendedor; luego 0.
+    comisiones: resultado de _comisiones_vendedor() si ya se cargó para este vendedor.
+    """
+    if comisiones is None:
+        comisiones = _comisiones_vendedor(conn, vendedor_id)
+    por_marca, base = comisiones
+    return por_marca.get(_norm_marca(marca), base)
+
+def _productos_por_id(conn, pids_raw):
+    """
+    {id: fila(id, nombre, marca)} para los ids del form, en una sola consulta IN.
+    Los ids que no son enteros se ignoran (el loop de ítems ya los descarta).
+    """
+    pids = set()
+    for raw in pids_raw:
+        try:
+            pids.add(int(raw))
+        except (TypeError, ValueError):
+            pass
+    if not pids:
+        return {}
+    marcadores = ",".join("?" * len(pids))
+    return {
+        r["id"]: r
+        for r in conn.execute(f"SELECT id, nombre, marca FROM productos WHERE id IN ({marcadores})", tuple(pids))
+    }
+
+# SQL de FEFO como constantes: el mismo texto en cada llamada pega en el cache
+# de statements de la conexión (cached_statements en database.py).
+# Stock del producto y lotes en una sola lectura: productos LEFT JOIN lotes, así
+# viene una fila (con id NULL) aunque no haya lotes; sin filas = no existe el producto.
+_FEFO_SELECT = """
+    SELECT p.cantidad AS disponible, ms.id, ms.cantidad_restante, ms.fecha_vencimiento
+      FROM productos p
+      LEFT JOIN movimientos_stock ms
+             ON ms.producto_id = p.id AND ms.tipo = 'entrada'
+            AND (ms.cantidad_restante IS NULL OR ms.cantidad_restante > 0)
+     WHERE p.id = ?
+     ORDER BY 
+       CASE WHEN ms.fecha_vencimiento IS NULL THEN 1 ELSE 0 END ASC,
+       ms.fecha_vencimiento ASC,
+       ms.id ASC
+"""
+_FEFO_UPD = "UPDATE movimientos_stock SET cantidad_restante = cantidad_restante - ? WHERE id = ?"
+_FEFO_INS = """
+    INSERT INTO movimientos_stock (producto_id, cantidad, tipo, proveedor_id, fecha_vencimiento, lote, fecha, entrada_id)
+    VALUES (?, ?, 'salida', NULL, ?, NULL, ?, ?)
+"""
 
 def consumir_stock_fefo(conn, producto_id: int, cantidad_a_vender: int):
-    """Descarga por FEFO."""
+    """
+    Descarga por FEFO. Primero calcula cuánto sale de cada lote y después
+    escribe todo junto (un UPDATE y un INSERT por executemany).
+    """
     if cantidad_a_vender <= 0:
         return
 
-    row = conn.execute("SELECT cantidad FROM productos WHERE id = ?", (producto_id,)).fetchone()
-    disponible = int(row["cantidad"] if row and row["cantidad"] is not None else 0)
+    if not conn.in_transaction:
+        # tomamos el lock de escritura antes de leer stock/lotes
+        conn.execute("BEGIN IMMEDIATE")
+
+    lotes = conn.execute(_FEFO_SELECT, (producto_id,)).fetchall()
+    disponible = int(lotes[0]["disponible"] if lotes and lotes[0]["disponible"] is not None else 0)
     if disponible < cantidad_a_vender:
         raise ValueError(f"Stock insuficiente para el producto {producto_id}. Disponible: {disponible}, requerido: {cantidad_a_vender}")
 
     restante = cantidad_a_vender
 
-    lotes = conn.execute("""
-        SELECT id, cantidad_restante, fecha_vencimiento
-          FROM movimientos_stock
-         WHERE producto_id = ? AND tipo = 'entrada' AND (cantidad_restante IS NULL OR cantidad_restante > 0)
-         ORDER BY 
-           CASE WHEN fecha_vencimiento IS NULL THEN 1 ELSE 0 END ASC,
-           fecha_vencimiento ASC,
-           id ASC
-    """, (producto_id,)).fetchall()
-
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    updates = []   # (usa, lote_id)
+    salidas = []   # filas 'salida' a insertar
     for lote in lotes:
         if restante <= 0:
             break
@@ -201,41 +420,117 @@ def consumir_stock_fefo(conn, producto_id: int, cantidad_a_vender: int):
             continue
 
         usa = min(lote_rest, restante)
-
-        conn.execute(
-            "UPDATE movimientos_stock SET cantidad_restante = cantidad_restante - ? WHERE id = ?",
-            (usa, lote["id"])
-        )
-        conn.execute(
-            """INSERT INTO movimientos_stock (producto_id, cantidad, tipo, proveedor_id, fecha_vencimiento, lote, fecha, entrada_id)
-               VALUES (?, ?, 'salida', NULL, ?, NULL, ?, ?)""",
-            (producto_id, usa, lote["fecha_vencimiento"], datetime.now().strftime('%Y-%m-%d'), lote["id"])
-        )
+        updates.append((usa, lote["id"]))
+        salidas.append((producto_id, usa, lote["fecha_vencimiento"], hoy, lote["id"]))
         restante -= usa
 
     if restante > 0:
         raise ValueError(f"No se pudo completar FEFO para el producto {producto_id}. Restante: {restante}")
 
+    conn.executemany(_FEFO_UPD, updates)
+    conn.executemany(_FEFO_INS, salidas)
+
 # ---------- Inicialización ----------
 _INIT_RAN = False
+_INIT_LOCK = threading.Lock()
 
 @app.before_request
 def initialize_database():
+    # el esquema no cambia entre requests: init_db + ensure_schema una sola vez por proceso
     global _INIT_RAN
     if not _INIT_RAN:
-        init_db()
-        ensure_schema()
-        _INIT_RAN = True
+        with _INIT_LOCK:
+            if not _INIT_RAN:
+                init_db()
+                ensure_schema()
+                _INIT_RAN = True
+
+# `hoy` para los <input type="date"> de los formularios, en todos los templates
+@app.context_processor
+def _fecha_hoy():
+    return {'hoy': datetime.now().strftime('%Y-%m-%d')}
+
+# ---------- Versión de datos (para caches de lectura) ----------
+# Todas las escrituras de la app son POST: cada POST terminado invalida los caches.
+_DATA_VERSION = 0
+
+@app.teardown_request
+def _bump_data_version(exc):
+    global _DATA_VERSION
+    if request.method == 'POST':
+        _DATA_VERSION += 1
+
+# Datos de referencia de los formularios (productos, vendedores, comisiones):
+# cambian poco, así que se guardan por nombre junto con la _DATA_VERSION con la
+# que se leyeron. El TTL cubre escrituras hechas por fuera de la app
+# (agregar_producto.py, migrar_db.py).
+_CONTEXTO_TTL = 30  # segundos
+_CONTEXTO_CACHE = {}
+
+def _contexto_cacheado(nombre, cargar):
+    """Devuelve cargar() cacheado bajo 'nombre' hasta la próxima escritura o el TTL."""
+    version = _DATA_VERSION  # antes de leer: una escritura concurrente invalida lo leído
+    hit = _CONTEXTO_CACHE.get(nombre)
+    if hit and hit[0] == version and time.monotonic() - hit[1] <= _CONTEXTO_TTL:
+        return hit[2]
+    datos = cargar()
+    _CONTEXTO_CACHE[nombre] = (version, time.monotonic(), datos)
+    return datos
+
+# HTML de los listados (vendedores, bonificaciones), como el JSON del dashboard:
+# (version, ts, body, etag) por nombre. Un GET repetido sin escrituras no hace
+# SQL ni Jinja, y si el navegador ya lo tiene responde 304.
+_LISTADO_CACHE = {}
+
+def _listado_cacheado(nombre, render):
+    # con mensajes flash pendientes el HTML es de un solo uso: ni se sirve ni se guarda
+    if '_flashes' in session:
+        return render()
+    version = _DATA_VERSION
+    hit = _LISTADO_CACHE.get(nombre)
+    if hit and hit[0] == version and time.monotonic() - hit[1] <= _CONTEXTO_TTL:
+        body, etag = hit[2], hit[3]
     else:
-        try:
-            ensure_schema()
-        except Exception:
-            pass
+        body = render().encode()
+        etag = hashlib.md5(body).hexdigest()
+        _LISTADO_CACHE[nombre] = (version, time.monotonic(), body, etag)
+    resp = Response(body, mimetype='text/html')
+    resp.set_etag(etag, weak=True)
+    return resp.make_conditional(request)
+
+# ---------- PDFs fuera del hilo del request ----------
+# ReportLab es CPU puro: los PDFs se generan en un pool acotado. La factura de una
+# venta se arma recién cuando se descarga (con los datos guardados en
+# ventas.factura_snapshot al vender); si dos pedidos llegan juntos esperan la misma.
+_PDF_EXEC = ThreadPoolExecutor(max_workers=4)
+_FACTURAS_EN_CURSO = {}  # venta_id -> Future de la que se está generando
+_FACTURAS_LOCK = threading.Lock()
+
+def _factura_lista(venta_id, fut):
+    with _FACTURAS_LOCK:
+        if _FACTURAS_EN_CURSO.get(venta_id) is fut:
+            del _FACTURAS_EN_CURSO[venta_id]
+
+def _factura_en_curso(venta_id, datos=None):
+    """
+    Future de la factura de venta_id: la que ya se está generando o, si se pasan
+    'datos' (kwargs de generate_invoice_pdf), una nueva. None si no hay ninguna.
+    """
+    with _FACTURAS_LOCK:
+        fut = _FACTURAS_EN_CURSO.get(venta_id)
+        if fut is not None or datos is None:
+            return fut
+        fut = _PDF_EXEC.submit(
+            generate_invoice_pdf, venta_id, alias_transferencia=ALIAS_TRANSFERENCIA, **datos
+        )
+        _FACTURAS_EN_CURSO[venta_id] = fut
+    fut.add_done_callback(lambda f: _factura_lista(venta_id, f))
+    return fut
 
 # ----------------- Dashboard -----------------
 @app.route('/')
 def dashboard():
-    conn = get_db_connection()
+    conn = get_db()
     try:
         hoy = datetime.now().strftime('%Y-%m-%d')
 
@@ -257,27 +552,17 @@ def dashboard():
         cant_ventas_hoy = conn.execute("SELECT COUNT(*) FROM ventas WHERE fecha = ?", (hoy,)).fetchone()[0]
         stock_bajo = len(productos_bajo_stock)
 
-        # Vencimientos (para mostrar en la barra lateral también)
-        venc_prox = conn.execute("""
-            SELECT ms.id AS mov_id, p.nombre, p.marca, ms.fecha_vencimiento, ms.cantidad_restante
+        # Vencimientos (para la barra lateral): solo se muestran los conteos
+        venc = conn.execute("""
+            SELECT COUNT(*) AS proximos,
+                   COALESCE(SUM(ms.fecha_vencimiento < date('now')), 0) AS vencidos
               FROM movimientos_stock ms
               JOIN productos p ON p.id = ms.producto_id
              WHERE ms.tipo='entrada'
                AND ms.fecha_vencimiento IS NOT NULL
                AND ms.cantidad_restante > 0
                AND ms.fecha_vencimiento <= date('now','+30 day')
-             ORDER BY ms.fecha_vencimiento
-        """).fetchall()
-        vencidos = conn.execute("""
-            SELECT ms.id AS mov_id, p.nombre, p.marca, ms.fecha_vencimiento, ms.cantidad_restante
-              FROM movimientos_stock ms
-              JOIN productos p ON p.id = ms.producto_id
-             WHERE ms.tipo='entrada'
-               AND ms.fecha_vencimiento IS NOT NULL
-               AND ms.cantidad_restante > 0
-               AND ms.fecha_vencimiento < date('now')
-             ORDER BY ms.fecha_vencimiento
-        """).fetchall()
+        """).fetchone()
 
     finally:
         conn.close()
@@ -291,153 +576,260 @@ def dashboard():
         ventas_mensuales=ventas_mensuales,
         cant_ventas_hoy=cant_ventas_hoy,
         stock_bajo=stock_bajo,
-        vencimientos_proximos=len(venc_prox),
-        vencimientos_vencidos=len(vencidos),
-        lista_vencimientos=venc_prox  # por si querés listarlos
+        vencimientos_proximos=venc["proximos"],
+        vencimientos_vencidos=venc["vencidos"]
     )
 
 # ----------------- Datos JSON para gráficos -----------------
+# ---------- SQL de rankings del dashboard ----------
+# Los períodos van como CTE con los límites calculados por SQLite: cada ranking
+# es un statement fijo (sin f-strings por request) que el cache de statements
+# reutiliza. Las filas se etiquetan con el período y ROW_NUMBER() corta el top 10.
+_PERIODOS = ("dia", "semana", "mes", "anio")
+_PERIODOS_PRODUCTOS = ("semana", "mes", "anio")
+
+_PERIODOS_CTE = """
+    periodos(periodo, desde, hasta) AS (
+        VALUES ('dia',    date('now'), date('now','+1 day')),
+               ('semana', date('now','-' || strftime('%w','now') || ' day'), '9999-12-31'),  -- domingo->hoy
+               ('mes',    date('now','start of month'), date('now','start of month','+1 month')),
+               ('anio',   date('now','start of year'),  date('now','start of year','+1 year'))
+    )"""
+
+_TOP_VENDEDORES_SQL = f"""
+    WITH {_PERIODOS_CTE}
+    SELECT periodo, vendedor, total FROM (
+        SELECT pe.periodo, v.nombre AS vendedor, TOTAL(ven.total) AS total,
+               ROW_NUMBER() OVER (PARTITION BY pe.periodo
+                                  ORDER BY TOTAL(ven.total) DESC) AS rn
+        FROM periodos pe
+        JOIN ventas ven  ON ven.fecha >= pe.desde AND ven.fecha < pe.hasta
+        JOIN vendedores v ON v.nombre = ven.cliente
+        GROUP BY pe.periodo, v.id
+    )
+    WHERE rn <= 10
+    ORDER BY periodo, rn
+"""
+
+_TOP_PRODUCTOS_VENDIDOS_SQL = f"""
+    WITH {_PERIODOS_CTE}
+    SELECT periodo, producto, unidades FROM (
+        SELECT pe.periodo, p.nombre AS producto, COALESCE(SUM(vi.cantidad),0) AS unidades,
+               ROW_NUMBER() OVER (PARTITION BY pe.periodo
+                                  ORDER BY COALESCE(SUM(vi.cantidad),0) DESC) AS rn
+        FROM periodos pe
+        JOIN ventas v        ON v.fecha >= pe.desde AND v.fecha < pe.hasta
+        JOIN ventas_items vi ON vi.venta_id = v.id
+        JOIN productos p     ON p.id = vi.producto_id
+        WHERE pe.periodo <> 'dia'
+        GROUP BY pe.periodo, vi.producto_id
+    )
+    WHERE rn <= 10
+    ORDER BY periodo, rn
+"""
+
+_TOP_PRODUCTOS_DEVUELTOS_SQL = f"""
+    WITH {_PERIODOS_CTE}
+    SELECT periodo, producto, unidades FROM (
+        SELECT pe.periodo, p.nombre AS producto, COALESCE(SUM(di.cantidad),0) AS unidades,
+               ROW_NUMBER() OVER (PARTITION BY pe.periodo
+                                  ORDER BY COALESCE(SUM(di.cantidad),0) DESC) AS rn
+        FROM periodos pe
+        JOIN devoluciones_cab dc   ON dc.fecha >= pe.desde AND dc.fecha < pe.hasta
+        JOIN devoluciones_items di ON di.devolucion_id = dc.id
+        JOIN productos p           ON p.id = di.producto_id
+        WHERE pe.periodo <> 'dia'
+        GROUP BY pe.periodo, di.producto_id
+    )
+    WHERE rn <= 10
+    ORDER BY periodo, rn
+"""
+
+# tabla vieja de devoluciones (fallback para períodos sin datos en el esquema nuevo)
+_TOP_PRODUCTOS_DEVUELTOS_VIEJO_SQL = f"""
+    WITH {_PERIODOS_CTE}
+    SELECT periodo, producto, unidades FROM (
+        SELECT pe.periodo, p.nombre AS producto, COALESCE(SUM(d.cantidad),0) AS unidades,
+               ROW_NUMBER() OVER (PARTITION BY pe.periodo
+                                  ORDER BY COALESCE(SUM(d.cantidad),0) DESC) AS rn
+        FROM periodos pe
+        JOIN devoluciones d ON d.fecha >= pe.desde AND d.fecha < pe.hasta
+        JOIN productos p    ON p.id = d.producto_id
+        WHERE pe.periodo <> 'dia'
+        GROUP BY pe.periodo, d.producto_id
+    )
+    WHERE rn <= 10
+    ORDER BY periodo, rn
+"""
+
+# Los valores ya salen con su tipo final desde SQLite: TOTAL() siempre es REAL
+# (0.0 si no hay filas) y COALESCE(SUM(cantidad),0) sobre INTEGER es entero, así
+# las filas se vuelcan al JSON sin float()/int()/"or 0" por fila.
+
+# columnas de las alertas en el orden del SELECT (las filas se arman con zip)
+_ALERTA_STOCK_COLS = ("id", "nombre", "marca", "cantidad", "cantidad_minima")
+_ALERTA_VENC_COLS = ("mov_id", "nombre", "marca", "fecha_vencimiento", "cantidad_restante", "precio_compra")
+
+@contextmanager
+def _raw_rows(conn):
+    """Dentro del bloque la conexión devuelve tuplas (row_factory=None)."""
+    prev = conn.row_factory
+    conn.row_factory = None
+    try:
+        yield conn
+    finally:
+        conn.row_factory = prev
+
+def _por_periodo(rows, periodos, etiqueta, valor):
+    """Reparte las filas (periodo, etiqueta, valor) de un ranking en {periodo: [...]}."""
+    out = {p: [] for p in periodos}
+    for periodo, nombre, v in rows:
+        out[periodo].append({etiqueta: nombre, valor: v})
+    return out
+
+# ---------- SQL de series del dashboard ----------
+# Los tres niveles salen en un solo statement por tabla (UNION ALL con la
+# columna 'nivel'); ROW_NUMBER() deja los últimos 12 (semanas/meses) o 5 (años).
+def _series_sql(tabla, col):
+    return f"""
+    SELECT nivel, bucket, total FROM (
+        SELECT nivel, bucket, total,
+               ROW_NUMBER() OVER (PARTITION BY nivel ORDER BY bucket DESC) AS rn
+        FROM (
+            SELECT 'semanal' AS nivel, strftime('%Y-W%W', fecha) AS bucket, TOTAL({col}) AS total
+              FROM {tabla} GROUP BY 2
+            UNION ALL
+            SELECT 'mensual', strftime('%Y-%m', fecha), TOTAL({col}) FROM {tabla} GROUP BY 2
+            UNION ALL
+            SELECT 'anual', strftime('%Y', fecha), TOTAL({col}) FROM {tabla} GROUP BY 2
+        )
+    )
+    WHERE rn <= CASE nivel WHEN 'anual' THEN 5 ELSE 12 END
+    ORDER BY nivel, bucket
+"""
+
+_SERIES_VENTAS_SQL = _series_sql("ventas", "total")
+_SERIES_GASTOS_SQL = _series_sql("gastos", "monto")
+
+def _por_nivel(rows):
+    """Filas (nivel, bucket, total) -> {"semanal": [...], "mensual": [...], "anual": [...]}."""
+    out = {"semanal": [], "mensual": [], "anual": []}
+    for nivel, bucket, total in rows:
+        out[nivel].append({"bucket": bucket, "total": total})
+    return out
+
+# Cache del JSON del dashboard: (clave, ts, body, etag). La clave incluye el día
+# y _DATA_VERSION, así cualquier escritura lo invalida; el TTL cubre lo que
+# depende de date('now') y cambios hechos por fuera de la app.
+_DASHBOARD_TTL = 30  # segundos
+_DASHBOARD_CACHE = (None, 0.0, None, None)
+
 @app.route('/dashboard-data')
 def dashboard_data():
-    conn = get_db_connection()
+    global _DASHBOARD_CACHE
+    clave = (datetime.now().strftime('%Y-%m-%d'), _DATA_VERSION)
+    c_clave, c_ts, body, etag = _DASHBOARD_CACHE
+    if c_clave != clave or time.monotonic() - c_ts > _DASHBOARD_TTL:
+        body = _dashboard_data_json()
+        etag = hashlib.md5(body).hexdigest()
+        _DASHBOARD_CACHE = (clave, time.monotonic(), body, etag)
+
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    return resp.make_conditional(request)  # 304 si el If-None-Match coincide
+
+def _dashboard_data_json():
+    """Arma el JSON (bytes) de /dashboard-data."""
+    conn = get_db()
     try:
         # Helpers de períodos (SQLite)
-        semana_ini = "date('now','-' || strftime('%w','now') || ' day')"  # domingo->hoy
-        mes_actual = "strftime('%Y-%m', fecha) = strftime('%Y-%m','now')"
-
-        # --- Ventas por mes (últimos 12) ---
-        vm = conn.execute("""
-            SELECT strftime('%Y-%m', fecha) AS mes, SUM(total) AS total
-            FROM ventas
-            GROUP BY mes
-            ORDER BY mes DESC
-            LIMIT 12
-        """).fetchall()
-        ventas_mensuales = [{"mes": r["mes"], "total": float(r["total"] or 0)} for r in reversed(vm)]
+        # Rangos sobre la columna (no strftime(fecha)) para que use el índice de fecha
+        mes_ini, mes_fin = "date('now','start of month')", "date('now','start of month','+1 month')"
+        mes_actual = f"fecha >= {mes_ini} AND fecha < {mes_fin}"
 
         # --- Ventas por día (últimos 30) ---
         vd = conn.execute("""
-            SELECT fecha, SUM(total) AS total
+            SELECT fecha, TOTAL(total) AS total
             FROM ventas
             WHERE fecha >= date('now','-30 day')
             GROUP BY fecha
             ORDER BY fecha
         """).fetchall()
-        ventas_diarias = [{"fecha": r["fecha"], "total": float(r["total"] or 0)} for r in vd]
-
-        # --- Ventas por semana (últimas 12) ---
-        vs = conn.execute("""
-            SELECT strftime('%Y-W%W', fecha) AS semana, SUM(total) AS total
-            FROM ventas
-            GROUP BY semana
-            ORDER BY semana DESC
-            LIMIT 12
-        """).fetchall()
-        ventas_semanales = [{"semana": r["semana"], "total": float(r["total"] or 0)} for r in reversed(vs)]
+        ventas_diarias = [{"fecha": f, "total": t} for f, t in vd]
 
         # ========= Alertas =========
+        # Una consulta por tabla: la columna 'bucket' separa bajo/cercano y vencido/próximo
         stock_cercania = 5  # configurable
-        stock_bajo = conn.execute("""
-            SELECT id, nombre, marca, cantidad, cantidad_minima
+        stock_bajo, stock_cercano = [], []
+        for r in conn.execute("""
+            SELECT id, nombre, marca, cantidad, cantidad_minima,
+                   CASE WHEN cantidad <= COALESCE(cantidad_minima, 0) THEN 'bajo' ELSE 'cercano' END AS bucket
             FROM productos
-            WHERE cantidad <= COALESCE(cantidad_minima, 0)
-            ORDER BY nombre
-        """).fetchall()
-        stock_cercano = conn.execute(f"""
-            SELECT id, nombre, marca, cantidad, cantidad_minima
-            FROM productos
-            WHERE cantidad > COALESCE(cantidad_minima, 0)
-              AND cantidad <= COALESCE(cantidad_minima, 0) + {stock_cercania}
-            ORDER BY nombre
-        """).fetchall()
-
-        # Vencimientos
-        venc_prox = conn.execute("""
+            WHERE cantidad <= COALESCE(cantidad_minima, 0) + ?
+            ORDER BY nombre, id
+        """, (stock_cercania,)):
+            fila = dict(zip(_ALERTA_STOCK_COLS, r))  # bucket queda afuera (última columna)
+            (stock_bajo if r["bucket"] == 'bajo' else stock_cercano).append(fila)
+
+        # Vencimientos (vencidos + próximos 30 días). La pérdida por vencimiento
+        # (restante * costo de los vencidos) la suma SQLite en la misma pasada.
+        venc_prox, vencidos = [], []
+        perdida_vencimiento = 0.0
+        for r in conn.execute("""
             SELECT ms.id AS mov_id, p.nombre, p.marca, ms.fecha_vencimiento, ms.cantidad_restante,
-                   COALESCE(p.precio_compra,0) AS precio_compra
+                   COALESCE(p.precio_compra,0) AS precio_compra,
+                   CASE WHEN ms.fecha_vencimiento <= date('now') THEN 'vencido' ELSE 'proximo' END AS bucket,
+                   TOTAL(CASE WHEN ms.fecha_vencimiento <= date('now')
+                              THEN COALESCE(ms.cantidad_restante,0) * COALESCE(p.precio_compra,0) END) OVER () AS perdida
             FROM movimientos_stock ms
             JOIN productos p ON p.id = ms.producto_id
             WHERE ms.tipo = 'entrada'
               AND ms.fecha_vencimiento IS NOT NULL
               AND ms.cantidad_restante > 0
-              AND ms.fecha_vencimiento > date('now')
               AND ms.fecha_vencimiento <= date('now','+30 day')
-            ORDER BY ms.fecha_vencimiento
-        """).fetchall()
-        vencidos = conn.execute("""
-            SELECT ms.id AS mov_id, p.nombre, p.marca, ms.fecha_vencimiento, ms.cantidad_restante,
-                   COALESCE(p.precio_compra,0) AS precio_compra
-            FROM movimientos_stock ms
-            JOIN productos p ON p.id = ms.producto_id
-            WHERE ms.tipo = 'entrada'
-              AND ms.fecha_vencimiento IS NOT NULL
-              AND ms.cantidad_restante > 0
-              AND ms.fecha_vencimiento <= date('now')
-            ORDER BY ms.fecha_vencimiento
-        """).fetchall()
-
-        perdida_vencimiento = 0.0
-        for r in vencidos:
-            try:
-                perdida_vencimiento += float(r["cantidad_restante"] or 0) * float(r["precio_compra"] or 0)
-            except Exception:
-                pass
+            ORDER BY ms.fecha_vencimiento, ms.id
+        """):
+            fila = dict(zip(_ALERTA_VENC_COLS, r))  # sin bucket/perdida
+            (vencidos if r["bucket"] == 'vencido' else venc_prox).append(fila)
+            perdida_vencimiento = r["perdida"]
 
         # ========= KPIs del mes =========
-        ventas_mes = conn.execute(f"""
-            SELECT COALESCE(SUM(total),0) AS t
-            FROM ventas WHERE {mes_actual}
-        """).fetchone()["t"] or 0.0
-
-        gastos_mes = conn.execute("""
-            SELECT COALESCE(SUM(monto),0) AS t
-            FROM gastos WHERE strftime('%Y-%m', fecha) = strftime('%Y-%m','now')
-        """).fetchone()["t"] or 0.0
-
-        # devoluciones del mes
-        dev_mes_nuevo = conn.execute("""
-            SELECT COALESCE(SUM(total),0) AS t
-            FROM devoluciones_cab
-            WHERE strftime('%Y-%m', fecha) = strftime('%Y-%m','now')
+        # Todas las sumas del mes en una sola consulta (subconsultas escalares)
+        kpis = conn.execute(f"""
+            SELECT
+              (SELECT COALESCE(SUM(total),0) FROM ventas           WHERE {mes_actual}) AS ventas_mes,
+              (SELECT COALESCE(SUM(monto),0) FROM gastos           WHERE {mes_actual}) AS gastos_mes,
+              (SELECT COALESCE(SUM(total),0) FROM devoluciones_cab WHERE {mes_actual}) AS dev_mes_nuevo,
+              (SELECT COALESCE(SUM(monto),0) FROM bonificaciones   WHERE {mes_actual}) AS bonificaciones_mes,
+              (SELECT COALESCE(SUM(monto),0) FROM pagos_vendedores WHERE {mes_actual}) AS pagos_mes,
+              -- costo de venta estimado (mes)
+              (SELECT COALESCE(SUM(vi.cantidad * COALESCE(p.precio_compra,0)),0)
+                 FROM ventas v
+                 JOIN ventas_items vi ON vi.venta_id = v.id
+                 JOIN productos p     ON p.id = vi.producto_id
+                WHERE v.fecha >= {mes_ini} AND v.fecha < {mes_fin}) AS cogs_mes
         """).fetchone()
-        dev_mes_nuevo = float(dev_mes_nuevo["t"] if dev_mes_nuevo else 0.0)
+        ventas_mes = kpis["ventas_mes"] or 0.0
+        gastos_mes = kpis["gastos_mes"] or 0.0
+        bonificaciones_mes = kpis["bonificaciones_mes"] or 0.0
+        pagos_mes = kpis["pagos_mes"] or 0.0
+        cogs_mes = kpis["cogs_mes"] or 0.0
+
+        # devoluciones del mes (la tabla vieja puede no tener el esquema esperado)
+        dev_mes_nuevo = float(kpis["dev_mes_nuevo"] or 0.0)
         try:
-            dev_mes_viejo = conn.execute("""
+            dev_mes_viejo = conn.execute(f"""
                 SELECT COALESCE(SUM(d.cantidad * vi.precio), 0) AS t
                 FROM devoluciones d
                 JOIN ventas ven      ON ven.id = d.venta_id
                 JOIN ventas_items vi ON vi.venta_id = d.venta_id AND vi.producto_id = d.producto_id
-                WHERE strftime('%Y-%m', d.fecha) = strftime('%Y-%m','now')
+                WHERE d.fecha >= {mes_ini} AND d.fecha < {mes_fin}
             """).fetchone()
             dev_mes_viejo = float(dev_mes_viejo["t"] if dev_mes_viejo else 0.0)
         except sqlite3.OperationalError:
             dev_mes_viejo = 0.0
         devoluciones_mes = dev_mes_nuevo + dev_mes_viejo
 
-        bonificaciones_mes = conn.execute("""
-            SELECT COALESCE(SUM(monto),0) AS t
-            FROM bonificaciones
-            WHERE strftime('%Y-%m', fecha) = strftime('%Y-%m','now')
-        """).fetchone()["t"] or 0.0
-
-        pagos_mes = conn.execute("""
-            SELECT COALESCE(SUM(monto),0) AS t
-            FROM pagos_vendedores
-            WHERE strftime('%Y-%m', fecha) = strftime('%Y-%m','now')
-        """).fetchone()["t"] or 0.0
-
-        # ========= Costo de venta estimado (mes) =========
-        try:
-            cogs_mes = conn.execute("""
-                SELECT COALESCE(SUM(vi.cantidad * COALESCE(p.precio_compra,0)),0) AS cogs
-                FROM ventas v
-                JOIN ventas_items vi ON vi.venta_id = v.id
-                JOIN productos p     ON p.id = vi.producto_id
-                WHERE strftime('%Y-%m', v.fecha) = strftime('%Y-%m','now')
-            """).fetchone()["cogs"] or 0.0
-        except sqlite3.OperationalError:
-            cogs_mes = 0.0
-
         margen_bruto = float(ventas_mes) - float(cogs_mes)
 
         # ========= Rendimiento del mes =========
@@ -473,15 +865,14 @@ def dashboard_data():
             """).fetchall()
             if pdev_new:
                 productos_mas_devueltos_hist = [
-                    {"producto": r["producto"], "unidades": int(r["unidades"] or 0)}
-                    for r in pdev_new
+                    {"producto": prod, "unidades": u} for prod, u in pdev_new
                 ]
             else:
                 raise sqlite3.OperationalError("sin datos en nuevo esquema")
         except sqlite3.OperationalError:
             try:
                 pdev_old = conn.execute("""
-                    SELECT p.nombre AS producto, SUM(d.cantidad) AS unidades
+                    SELECT p.nombre AS producto, COALESCE(SUM(d.cantidad),0) AS unidades
                       FROM devoluciones d
                       JOIN productos p ON p.id = d.producto_id
                   GROUP BY d.producto_id
@@ -489,152 +880,50 @@ def dashboard_data():
                      LIMIT 10
                 """).fetchall()
                 productos_mas_devueltos_hist = [
-                    {"producto": r["producto"], "unidades": int(r["unidades"] or 0)}
-                    for r in pdev_old
+                    {"producto": prod, "unidades": u} for prod, u in pdev_old
                 ]
             except sqlite3.OperationalError:
                 productos_mas_devueltos_hist = []
 
-        # ========= Mejores vendedores =========
-        def top_vendedores(filtro_sql):
-            rows = conn.execute(f"""
-                SELECT v.nombre AS vendedor, COALESCE(SUM(ven.total),0) AS total
-                FROM vendedores v
-                LEFT JOIN ventas ven ON ven.cliente = v.nombre
-                WHERE 1=1 {filtro_sql}
-                GROUP BY v.id
-                ORDER BY total DESC
-                LIMIT 10
-            """).fetchall()
-            return [{"vendedor": r["vendedor"], "total": float(r["total"] or 0)} for r in rows]
-
-        mejores_vendedores = {
-            "dia":    top_vendedores("AND ven.fecha = date('now')"),
-            "semana": top_vendedores("AND ven.fecha >= " + semana_ini),
-            "mes":    top_vendedores(f"AND {mes_actual.replace('fecha','ven.fecha')}"),
-            "anio":   top_vendedores("AND strftime('%Y', ven.fecha) = strftime('%Y','now')")
-        }
-
-        # ========= Productos (vendidos/pedidos) =========
-        def top_productos_vendidos(where_fecha_sql):
-            rows = conn.execute(f"""
-                SELECT p.nombre AS producto, COALESCE(SUM(vi.cantidad),0) AS unidades
-                FROM ventas v
-                JOIN ventas_items vi ON vi.venta_id = v.id
-                JOIN productos p ON p.id = vi.producto_id
-                WHERE {where_fecha_sql}
-                GROUP BY vi.producto_id
-                ORDER BY unidades DESC
-                LIMIT 10
-            """).fetchall()
-            return [{"producto": r["producto"], "unidades": int(r["unidades"] or 0)} for r in rows]
-
-        productos_mas_vendidos = {
-            "semana": top_productos_vendidos(f"v.fecha >= {semana_ini}"),
-            "mes":    top_productos_vendidos("strftime('%Y-%m', v.fecha) = strftime('%Y-%m','now')"),
-            "anio":   top_productos_vendidos("strftime('%Y', v.fecha) = strftime('%Y','now')"),
-        }
-        # "Pedidos" = equivalentes a vendidos (no hay tabla de pedidos separada)
-        productos_mas_pedidos = productos_mas_vendidos
-
-        # ========= Productos más devueltos por período =========
-        def top_productos_devueltos(where_fecha_sql):
-            rows_new = conn.execute(f"""
-                SELECT p.nombre AS producto, COALESCE(SUM(di.cantidad),0) AS unidades
-                FROM devoluciones_cab dc
-                JOIN devoluciones_items di ON di.devolucion_id = dc.id
-                JOIN productos p ON p.id = di.producto_id
-                WHERE {where_fecha_sql}
-                GROUP BY di.producto_id
-                ORDER BY unidades DESC
-                LIMIT 10
-            """).fetchall()
-            out = [{"producto": r["producto"], "unidades": int(r["unidades"] or 0)} for r in rows_new]
-            if not out:
+        # Rankings y series se procesan por posición: filas como tuplas, sin sqlite3.Row
+        with _raw_rows(conn):
+            # ========= Rankings por período =========
+            # ========= Mejores vendedores =========
+            rows = conn.execute(_TOP_VENDEDORES_SQL).fetchall()
+            mejores_vendedores = _por_periodo(rows, _PERIODOS, "vendedor", "total")
+
+            # ========= Productos (vendidos/pedidos) =========
+            rows = conn.execute(_TOP_PRODUCTOS_VENDIDOS_SQL).fetchall()
+            productos_mas_vendidos = _por_periodo(rows, _PERIODOS_PRODUCTOS, "producto", "unidades")
+            # "Pedidos" = equivalentes a vendidos (no hay tabla de pedidos separada)
+            productos_mas_pedidos = productos_mas_vendidos
+
+            # ========= Productos más devueltos por período =========
+            rows = conn.execute(_TOP_PRODUCTOS_DEVUELTOS_SQL).fetchall()
+            productos_mas_devueltos = _por_periodo(rows, _PERIODOS_PRODUCTOS, "producto", "unidades")
+
+            # períodos sin datos en el esquema nuevo: probamos la tabla vieja
+            faltan = [p for p in _PERIODOS_PRODUCTOS if not productos_mas_devueltos[p]]
+            if faltan:
                 try:
-                    rows_old = conn.execute(f"""
-                        SELECT p.nombre AS producto, COALESCE(SUM(d.cantidad),0) AS unidades
-                        FROM devoluciones d
-                        JOIN productos p ON p.id = d.producto_id
-                        WHERE {where_fecha_sql.replace('dc.fecha','d.fecha')}
-                        GROUP BY d.producto_id
-                        ORDER BY unidades DESC
-                        LIMIT 10
-                    """).fetchall()
-                    out = [{"producto": r["producto"], "unidades": int(r["unidades"] or 0)} for r in rows_old]
+                    rows = conn.execute(_TOP_PRODUCTOS_DEVUELTOS_VIEJO_SQL).fetchall()
+                    viejos = _por_periodo(rows, _PERIODOS_PRODUCTOS, "producto", "unidades")
+                    for p in faltan:
+                        productos_mas_devueltos[p] = viejos[p]
                 except sqlite3.OperationalError:
                     pass
-            return out
 
-        productos_mas_devueltos = {
-            "semana": top_productos_devueltos(f"dc.fecha >= {semana_ini}"),
-            "mes":    top_productos_devueltos("strftime('%Y-%m', dc.fecha) = strftime('%Y-%m','now')"),
-            "anio":   top_productos_devueltos("strftime('%Y', dc.fecha) = strftime('%Y','now')"),
-        }
+            # ========= Series ventas / gastos =========
+            # Una consulta por tabla con los tres niveles (semanal/mensual/anual)
+            ventas_series = _por_nivel(conn.execute(_SERIES_VENTAS_SQL).fetchall())
+            gastos_series = _por_nivel(conn.execute(_SERIES_GASTOS_SQL).fetchall())
 
-        # ========= Series ventas / gastos =========
-        ventas_series = {
-            "semanal": [
-                {"bucket": r["sem"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y-W%W', fecha) AS sem, SUM(total) AS total
-                    FROM ventas
-                    GROUP BY sem
-                    ORDER BY sem DESC LIMIT 12
-                """).fetchall()[::-1]
-            ],
-            "mensual": [
-                {"bucket": r["mes"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y-%m', fecha) AS mes, SUM(total) AS total
-                    FROM ventas
-                    GROUP BY mes
-                    ORDER BY mes DESC LIMIT 12
-                """).fetchall()[::-1]
-            ],
-            "anual": [
-                {"bucket": r["anio"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y', fecha) AS anio, SUM(total) AS total
-                    FROM ventas
-                    GROUP BY anio
-                    ORDER BY anio DESC LIMIT 5
-                """).fetchall()[::-1]
-            ],
-        }
+        # últimos 12 meses / 12 semanas: mismas series que arriba, con sus claves de siempre
+        ventas_mensuales = [{"mes": x["bucket"], "total": x["total"]} for x in ventas_series["mensual"]]
+        ventas_semanales = [{"semana": x["bucket"], "total": x["total"]} for x in ventas_series["semanal"]]
 
-        gastos_series = {
-            "semanal": [
-                {"bucket": r["sem"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y-W%W', fecha) AS sem, SUM(monto) AS total
-                    FROM gastos
-                    GROUP BY sem
-                    ORDER BY sem DESC LIMIT 12
-                """).fetchall()[::-1]
-            ],
-            "mensual": [
-                {"bucket": r["mes"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y-%m', fecha) AS mes, SUM(monto) AS total
-                    FROM gastos
-                    GROUP BY mes
-                    ORDER BY mes DESC LIMIT 12
-                """).fetchall()[::-1]
-            ],
-            "anual": [
-                {"bucket": r["anio"], "total": float(r["total"] or 0)}
-                for r in conn.execute("""
-                    SELECT strftime('%Y', fecha) AS anio, SUM(monto) AS total
-                    FROM gastos
-                    GROUP BY anio
-                    ORDER BY anio DESC LIMIT 5
-                """).fetchall()[::-1]
-            ],
-        }
-
-        # Respuesta
-        return jsonify({
+        # Respuesta (bytes: se cachea tal cual en dashboard_data)
+        return json.dumps({
             # existentes
             "ventas_mensuales": ventas_mensuales,
             "ventas_semanales": ventas_semanales,
@@ -642,10 +931,10 @@ def dashboard_data():
             "productos_mas_devueltos_hist": productos_mas_devueltos_hist,
             # alertas
             "alertas": {
-                "stock_bajo": [dict(r) for r in stock_bajo],
-                "stock_cercano": [dict(r) for r in stock_cercano],
-                "vencimiento_proximo": [dict(r) for r in venc_prox],
-                "vencido": [dict(r) for r in vencidos],
+                "stock_bajo": stock_bajo,
+                "stock_cercano": stock_cercano,
+                "vencimiento_proximo": venc_prox,
+                "vencido": vencidos,
                 "perdida_vencimiento": float(perdida_vencimiento)
             },
             # KPIs del mes
@@ -668,102 +957,86 @@ def dashboard_data():
                 "ventas": ventas_series,
                 "gastos": gastos_series
             }
-        })
+        }, separators=(",", ":")).encode()
     finally:
         conn.close()
 
 # ---------- Saldos por vendedor ----------
-def _stats_por_vendedor(conn):
-    stats = {}
-    vendedores = conn.execute("SELECT id, nombre FROM vendedores").fetchall()
-    # Agregamos 'bonificaciones' como alias claro de 'bonificado' para el template
-    for v in vendedores:
-        stats[v["id"]] = {
-            "retirado": 0.0,
-            "devuelto": 0.0,
-            "pagado": 0.0,
-            "bonificado": 0.0,
-            "bonificaciones": 0.0,
-            "saldo": 0.0
-        }
-
-    # Retirado por ventas
-    for row in conn.execute("""
-        SELECT v.id AS vendedor_id, COALESCE(SUM(ven.total), 0) AS retirado
+# Retirado / devuelto / pagado / bonificado salen de un UNION ALL de las fuentes
+# con la etiqueta del rubro; el pivot por vendedor y el saldo los hace SQLite.
+# Las ventas (y las devoluciones viejas) se suman por cliente antes de cruzar con vendedores.
+_STATS_VENDEDOR_FUENTES = """
+        SELECT v.id, 'retirado', vs.t
+          FROM (SELECT cliente, TOTAL(total) AS t FROM ventas GROUP BY cliente) vs
+          JOIN vendedores v ON v.nombre = vs.cliente
+        UNION ALL
+        SELECT vendedor_id, 'devuelto', total FROM devoluciones_cab
+        UNION ALL
+        SELECT vendedor_id, 'pagado', monto FROM pagos_vendedores
+        UNION ALL
+        SELECT vendedor_id, 'bonificado', monto FROM bonificaciones"""
+
+# Compat: tabla vieja 'devoluciones' (puede no tener el esquema esperado)
+_STATS_VENDEDOR_FUENTE_VIEJA = """
+        UNION ALL
+        SELECT v.id, 'devuelto', ds.t
+          FROM (SELECT ven.cliente AS cliente, SUM(d.cantidad * vi.precio) AS t
+                  FROM devoluciones d
+                  JOIN ventas ven      ON ven.id = d.venta_id
+                  JOIN ventas_items vi ON vi.venta_id = d.venta_id AND vi.producto_id = d.producto_id
+                 GROUP BY ven.cliente) ds
+          JOIN vendedores v ON v.nombre = ds.cliente"""
+
+def _stats_vendedor_sql(fuentes):
+    return f"""
+    WITH src(vendedor_id, rubro, monto) AS ({fuentes}
+    ),
+    t AS (
+        SELECT v.id,
+               TOTAL(s.monto) FILTER (WHERE s.rubro = 'retirado')   AS retirado,
+               TOTAL(s.monto) FILTER (WHERE s.rubro = 'devuelto')   AS devuelto,
+               TOTAL(s.monto) FILTER (WHERE s.rubro = 'pagado')     AS pagado,
+               TOTAL(s.monto) FILTER (WHERE s.rubro = 'bonificado') AS bonificado
           FROM vendedores v
-          LEFT JOIN ventas ven ON ven.cliente = v.nombre
+          LEFT JOIN src s ON s.vendedor_id = v.id
+         WHERE ?1 IS NULL OR v.id = ?1
          GROUP BY v.id
-    """):
-        stats[row["vendedor_id"]]["retirado"] = float(row["retirado"] or 0)
-
-    # Devuelto (nuevo esquema)
-    try:
-        for row in conn.execute("""
-            SELECT vendedor_id, COALESCE(SUM(total),0) AS devuelto
-              FROM devoluciones_cab
-             GROUP BY vendedor_id
-        """):
-            vid = row["vendedor_id"]
-            if vid in stats:
-                stats[vid]["devuelto"] += float(row["devuelto"] or 0)
-    except sqlite3.OperationalError:
-        pass
+    )
+    SELECT id, retirado, devuelto, pagado, bonificado,
+           retirado - devuelto - pagado - bonificado AS saldo
+      FROM t
+"""
 
-    # Compat: tabla vieja 'devoluciones'
-    try:
-        for row in conn.execute("""
-            SELECT v.id AS vendedor_id,
-                   COALESCE(SUM(dev.cantidad * vi.precio), 0) AS devuelto_old
-              FROM vendedores v
-              LEFT JOIN ventas ven       ON ven.cliente = v.nombre
-              LEFT JOIN devoluciones dev ON dev.venta_id = ven.id
-              LEFT JOIN ventas_items vi  ON vi.venta_id = dev.venta_id AND vi.producto_id = dev.producto_id
-             GROUP BY v.id
-        """):
-            vid = row["vendedor_id"]
-            if vid in stats:
-                stats[vid]["devuelto"] += float(row["devuelto_old"] or 0)
-    except sqlite3.OperationalError:
-        pass
+_STATS_VENDEDOR_SQL = _stats_vendedor_sql(_STATS_VENDEDOR_FUENTES + _STATS_VENDEDOR_FUENTE_VIEJA)
+_STATS_VENDEDOR_SIN_VIEJA_SQL = _stats_vendedor_sql(_STATS_VENDEDOR_FUENTES)
 
-    # Pagos a vendedores
-    try:
-        for row in conn.execute("""
-            SELECT vendedor_id, COALESCE(SUM(monto), 0) AS pagado
-              FROM pagos_vendedores
-             GROUP BY vendedor_id
-        """):
-            vid = row["vendedor_id"]
-            if vid in stats:
-                stats[vid]["pagado"] = float(row["pagado"] or 0)
-    except sqlite3.OperationalError:
-        pass
-
-    # Bonificaciones (sumatoria y alias)
+def _stats_por_vendedor(conn, vendedor_id=None):
+    """
+    {vendedor_id: {retirado, devuelto, pagado, bonificado, bonificaciones, saldo}}.
+    Con vendedor_id solo arma el de ese vendedor.
+    """
     try:
-        for row in conn.execute("""
-            SELECT vendedor_id, COALESCE(SUM(monto), 0) AS boni
-              FROM bonificaciones
-             GROUP BY vendedor_id
-        """):
-            vid = row["vendedor_id"]
-            if vid in stats:
-                total_boni = float(row["boni"] or 0)
-                stats[vid]["bonificado"] = total_boni
-                stats[vid]["bonificaciones"] = total_boni
+        rows = conn.execute(_STATS_VENDEDOR_SQL, (vendedor_id,)).fetchall()
     except sqlite3.OperationalError:
-        pass
-
-    for vid, s in stats.items():
-        s["saldo"] = s["retirado"] - s["devuelto"] - s["pagado"] - s["bonificado"]
-
-    return stats
+        rows = conn.execute(_STATS_VENDEDOR_SIN_VIEJA_SQL, (vendedor_id,)).fetchall()
+    # 'bonificaciones' es alias claro de 'bonificado' para el template
+    return {
+        vid: {
+            "retirado": ret,
+            "devuelto": dev,
+            "pagado": pag,
+            "bonificado": bon,
+            "bonificaciones": bon,
+            "saldo": saldo
+        }
+        for vid, ret, dev, pag, bon, saldo in rows
+    }
 
 # ----------------- Ventas -----------------
 @app.route('/ventas', methods=['GET', 'POST'])
 def ventas():
     if request.method == 'POST':
-        conn = get_db_connection()
+        conn = get_db()
         try:
             vendedor_id = request.form.get('vendedor_id')
             if not vendedor_id:
@@ -775,6 +1048,10 @@ def ventas():
                 flash('Vendedor inválido.')
                 return redirect(url_for('ventas'))
 
+            # Toda la venta (lecturas + FEFO + inserts) en una transacción que toma el
+            # lock de escritura de entrada; los return tempranos la descartan en close()
+            conn.execute("BEGIN IMMEDIATE")
+
             vendedor_row = conn.execute(
                 'SELECT id, nombre, comision, telefono FROM vendedores WHERE id = ?',
                 (vendedor_id_int,)
@@ -796,23 +1073,23 @@ def ventas():
             total_bruto = 0.0
             total_descuento = 0.0
             items = []
+            comisiones = _comisiones_vendedor(conn, vendedor_id_int)
+            prod_map = _productos_por_id(conn, productos)
 
-            for i in range(len(productos)):
+            # las cuatro listas van juntas; pct[] puede venir más corta (sin % manual)
+            for pid_raw, qty_raw, prc_raw, pct_raw in zip_longest(productos, cantidades, precios, pct_list, fillvalue=''):
                 # parseo defensivo
                 try:
-                    pid_raw = productos[i]
-                    qty_raw = cantidades[i] if i < len(cantidades) else '0'
-                    prc_raw = precios[i]    if i < len(precios)    else '0'
                     pid = int(pid_raw)
-                    qty = int(qty_raw)
-                    prc = float((prc_raw or '0').replace(',', '.'))
-                except (TypeError, ValueError, IndexError):
+                    qty = _to_int(qty_raw)
+                    prc = _to_float(prc_raw)
+                except (TypeError, ValueError):
                     continue
 
                 if qty <= 0:
                     continue
 
-                prow = conn.execute('SELECT nombre, marca FROM productos WHERE id = ?', (pid,)).fetchone()
+                prow = prod_map.get(pid)
                 prod_nombre = prow['nombre'] if prow else f'Producto {pid}'
                 prod_marca  = prow['marca']  if prow else None
 
@@ -821,15 +1098,14 @@ def ventas():
 
                 # % comisión manual si el input no está vacío; si no, usar la regla vendedor+marca
                 pct_manual = None
-                if i < len(pct_list):
-                    raw_pct = (pct_list[i] or '').strip()
-                    if raw_pct != '':
-                        try:
-                            pct_manual = float(raw_pct.replace(',', '.'))
-                        except Exception:
-                            pct_manual = None
-
-                pct = pct_manual if pct_manual is not None else _get_comision_pct(conn, vendedor_id_int, prod_marca)
+                raw_pct = pct_raw.strip()
+                if raw_pct:
+                    try:
+                        pct_manual = _to_float(raw_pct)
+                    except ValueError:
+                        pct_manual = None
+
+                pct = pct_manual if pct_manual is not None else _get_comision_pct(conn, vendedor_id_int, prod_marca, comisiones)
                 total_descuento += subtotal * (pct / 100.0)
 
                 items.append({
@@ -846,7 +1122,8 @@ def ventas():
                 flash('No se agregó ningún ítem válido.')
                 return redirect(url_for('ventas'))
 
-            # FEFO + descarga de stock
+            # FEFO + descarga de stock (el UPDATE va ítem por ítem a propósito: el chequeo
+            # de stock de un renglón repetido tiene que ver lo que ya descontó el anterior)
             try:
                 for it in items:
                     consumir_stock_fefo(conn, it['producto'], it['cantidad'])
@@ -860,55 +1137,60 @@ def ventas():
                 return redirect(url_for('ventas'))
 
             total_neto = total_bruto - total_descuento
+            fecha = datetime.now().strftime('%Y-%m-%d')
 
-            venta_id = conn.execute(
+            venta_id = _insertar(
+                conn,
                 'INSERT INTO ventas (cliente, total, fecha) VALUES (?, ?, ?)',
-                (vendedor_nombre, total_neto, datetime.now().strftime('%Y-%m-%d'))
-            ).lastrowid
+                (vendedor_nombre, total_neto, fecha)
+            )
 
-            for it in items:
-                conn.execute(
-                    'INSERT INTO ventas_items (venta_id, producto_id, cantidad, precio) VALUES (?, ?, ?, ?)',
-                    (venta_id, it['producto'], it['cantidad'], it['precio'])
-                )
+            conn.executemany(
+                'INSERT INTO ventas_items (venta_id, producto_id, cantidad, precio) VALUES (?, ?, ?, ?)',
+                [(venta_id, it['producto'], it['cantidad'], it['precio']) for it in items]
+            )
 
             # resumen del vendedor para el PDF
-            stats_all = _stats_por_vendedor(conn)
-            stats_v = stats_all.get(vendedor_id_int, None)
+            stats_v = _stats_por_vendedor(conn, vendedor_id_int).get(vendedor_id_int)
+
+            # datos de la factura tal como quedan al vender (el PDF se genera al descargarla)
+            snapshot = {
+                "vendedor_nombre": vendedor_nombre,
+                "items": items,
+                "total_neto": total_neto,
+                "fecha": fecha,
+                "vendedor_telefono": vendedor_tel,
+                "vendedor_id": vendedor_id_int,
+                "stats": stats_v,
+            }
+            conn.execute(
+                "UPDATE ventas SET factura_snapshot = ? WHERE id = ?",
+                (json.dumps(snapshot, separators=(",", ":")), venta_id)
+            )
 
             conn.commit()
         finally:
             conn.close()
 
-        fecha = datetime.now().strftime('%Y-%m-%d')
-        generate_invoice_pdf(
-            venta_id,
-            vendedor_nombre,
-            items,
-            total_neto,
-            fecha,
-            vendedor_telefono=vendedor_tel,
-            vendedor_id=vendedor_id_int,
-            alias_transferencia=ALIAS_TRANSFERENCIA,
-            stats=stats_v
-        )
         flash('Venta registrada. Comisión aplicada por marca. Descargá la factura.')
         return redirect(url_for('descargar_factura', venta_id=venta_id))
 
     # -------------------- GET --------------------
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        productos = conn.execute(
-            'SELECT id, nombre, marca, precio_venta AS precio FROM productos WHERE cantidad > 0 ORDER BY nombre'
-        ).fetchall()
-        vendedores = conn.execute(
-            'SELECT id, nombre, comision, telefono FROM vendedores ORDER BY nombre'
-        ).fetchall()
-        comisiones = conn.execute(
-            'SELECT vendedor_id, marca, comision_pct FROM comisiones_vendedor_marca'
-        ).fetchall()
+        productos, vendedores, comisiones = _contexto_cacheado('ventas', lambda: (
+            conn.execute(
+                'SELECT id, nombre, marca, precio_venta AS precio FROM productos WHERE cantidad > 0 ORDER BY nombre'
+            ).fetchall(),
+            conn.execute(
+                'SELECT id, nombre, comision, telefono FROM vendedores ORDER BY nombre'
+            ).fetchall(),
+            conn.execute(
+                'SELECT vendedor_id, marca, comision_pct FROM comisiones_vendedor_marca'
+            ).fetchall(),
+        ))
         ventas_recientes = conn.execute(
-            "SELECT id, cliente, fecha, total FROM ventas ORDER BY date(fecha) DESC, id DESC LIMIT 10"
+            "SELECT id, cliente, fecha, total FROM ventas ORDER BY fecha DESC, id DESC LIMIT 10"
         ).fetchall()
     finally:
         conn.close()
@@ -922,18 +1204,18 @@ def ventas():
 # ---- Borrar venta ----
 @app.route('/ventas/delete/<int:venta_id>', methods=['POST'], endpoint='ventas_delete')
 def ventas_delete(venta_id):
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        try:
-            conn.execute('DELETE FROM ventas_items WHERE venta_id=?', (venta_id,))
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute('DELETE FROM devoluciones WHERE venta_id=?', (venta_id,))
-        except sqlite3.OperationalError:
-            pass
-        conn.execute('DELETE FROM ventas WHERE id=?', (venta_id,))
-        conn.commit()
+        with conn:
+            try:
+                conn.execute('DELETE FROM ventas_items WHERE venta_id=?', (venta_id,))
+            except sqlite3.OperationalError:
+                pass
+            try:
+                conn.execute('DELETE FROM devoluciones WHERE venta_id=?', (venta_id,))
+            except sqlite3.OperationalError:
+                pass
+            conn.execute('DELETE FROM ventas WHERE id=?', (venta_id,))
         flash(f'Venta {venta_id} eliminada.')
     finally:
         conn.close()
@@ -942,10 +1224,8 @@ def ventas_delete(venta_id):
 # ----------------- Devoluciones (como ventas) -----------------
 @app.route('/devoluciones', methods=['GET', 'POST'])
 def devoluciones():
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        ensure_schema()  # asegura tablas nuevas
-
         if request.method == 'POST':
             vendedor_id_raw = (request.form.get('vendedor_id') or '').strip()
             if not vendedor_id_raw:
@@ -957,6 +1237,9 @@ def devoluciones():
                 flash('Vendedor inválido.')
                 return redirect(url_for('devoluciones'))
 
+            # misma idea que en ventas: una sola transacción con el lock tomado de entrada
+            conn.execute("BEGIN IMMEDIATE")
+
             vendedor_row = conn.execute(
                 "SELECT id, nombre, comision FROM vendedores WHERE id=?", (vendedor_id,)
             ).fetchone()
@@ -975,29 +1258,30 @@ def devoluciones():
             total_bruto = 0.0
             total_desc  = 0.0
             items = []
+            comisiones = _comisiones_vendedor(conn, vendedor_id)
+            prod_map = _productos_por_id(conn, productos)
 
-            for i in range(len(productos)):
+            for pid_raw, qty_raw, prc_raw, pct_raw in zip_longest(productos, cantidades, precios, pct_list, fillvalue=''):
                 try:
-                    pid = int(productos[i])
-                    qty = int((cantidades[i] or '0'))
-                    prc = float((precios[i] or '0').replace(',', '.'))
-                except Exception:
+                    pid = int(pid_raw)
+                    qty = _to_int(qty_raw)
+                    prc = _to_float(prc_raw)
+                except (TypeError, ValueError):
                     continue
                 if qty <= 0:
                     continue
 
-                prow = conn.execute("SELECT nombre, marca FROM productos WHERE id=?", (pid,)).fetchone()
+                prow = prod_map.get(pid)
                 prod_marca = prow["marca"] if prow else None
 
                 pct_manual = None
-                if i < len(pct_list):
-                    raw_pct = (pct_list[i] or '').strip()
-                    if raw_pct != '':
-                        try:
-                            pct_manual = float(raw_pct.replace(',', '.'))
-                        except Exception:
-                            pct_manual = None
-                pct = pct_manual if pct_manual is not None else _get_comision_pct(conn, vendedor_id, prod_marca)
+                raw_pct = pct_raw.strip()
+                if raw_pct:
+                    try:
+                        pct_manual = _to_float(raw_pct)
+                    except ValueError:
+                        pct_manual = None
+                pct = pct_manual if pct_manual is not None else _get_comision_pct(conn, vendedor_id, prod_marca, comisiones)
 
                 subtotal = qty * prc
                 desc = subtotal * (pct/100.0)
@@ -1019,41 +1303,43 @@ def devoluciones():
 
             total_neto = total_bruto - total_desc  # neto a considerar como "devuelto"
 
-            devolucion_id = conn.execute(
-                "INSERT INTO devoluciones_cab (vendedor_id, vendedor_nombre, motivo, total, fecha) VALUES (?, ?, ?, ?, ?)",
-                (vendedor_id, vendedor_nombre, motivo, total_neto, datetime.now().strftime('%Y-%m-%d'))
-            ).lastrowid
+            devolucion_id = _insertar(
+                conn,
+                "INSERT INTO devoluciones_cab (vendedor_id, vendedor_nombre, motivo, total, fecha) VALUES (?, ?, ?, ?, date('now','localtime'))",
+                (vendedor_id, vendedor_nombre, motivo, total_neto)
+            )
 
-            for it in items:
-                conn.execute(
-                    "INSERT INTO devoluciones_items (devolucion_id, producto_id, cantidad, precio, pct, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
-                    (devolucion_id, it['producto'], it['cantidad'], it['precio'], it['pct'], it['subtotal'])
-                )
-                # Reponer stock
-                conn.execute(
-                    "UPDATE productos SET cantidad = cantidad + ? WHERE id = ?",
-                    (it['cantidad'], it['producto'])
-                )
+            conn.executemany(
+                "INSERT INTO devoluciones_items (devolucion_id, producto_id, cantidad, precio, pct, subtotal) VALUES (?, ?, ?, ?, ?, ?)",
+                [(devolucion_id, it['producto'], it['cantidad'], it['precio'], it['pct'], it['subtotal']) for it in items]
+            )
+            # Reponer stock
+            conn.executemany(
+                "UPDATE productos SET cantidad = cantidad + ? WHERE id = ?",
+                [(it['cantidad'], it['producto']) for it in items]
+            )
 
             conn.commit()
             flash('Devolución registrada.')
             return redirect(url_for('devoluciones'))
 
         # ---------- GET ----------
-        productos = conn.execute(
-            "SELECT id, nombre, marca, precio_venta AS precio FROM productos ORDER BY nombre"
-        ).fetchall()
-        vendedores = conn.execute(
-            "SELECT id, nombre, comision, telefono FROM vendedores ORDER BY nombre"
-        ).fetchall()
-        comisiones = conn.execute(
-            "SELECT vendedor_id, marca, comision_pct FROM comisiones_vendedor_marca"
-        ).fetchall()
+        productos, vendedores, comisiones = _contexto_cacheado('devoluciones', lambda: (
+            conn.execute(
+                "SELECT id, nombre, marca, precio_venta AS precio FROM productos ORDER BY nombre"
+            ).fetchall(),
+            conn.execute(
+                "SELECT id, nombre, comision, telefono FROM vendedores ORDER BY nombre"
+            ).fetchall(),
+            conn.execute(
+                "SELECT vendedor_id, marca, comision_pct FROM comisiones_vendedor_marca"
+            ).fetchall(),
+        ))
 
         devoluciones_recientes = conn.execute("""
             SELECT id, vendedor_nombre AS vendedor, fecha, total
               FROM devoluciones_cab
-          ORDER BY date(fecha) DESC, id DESC
+          ORDER BY fecha DESC, id DESC
              LIMIT 10
         """).fetchall()
 
@@ -1082,18 +1368,18 @@ def devoluciones_update():
 
     sets, params = [], []
     if vendedor_nombre:
-        sets.append("vendedor_nombre = ?")
+        sets.append("vendedor_nombre")
         params.append(vendedor_nombre)
     if fecha:
-        sets.append("fecha = ?")
+        sets.append("fecha")
         params.append(fecha)
     if total_raw is not None:
         try:
-            total = float((total_raw or '0').replace(',', '.'))
+            total = _to_float(total_raw)
         except Exception:
             flash('Total inválido.')
             return redirect(url_for('devoluciones'))
-        sets.append("total = ?")
+        sets.append("total")
         params.append(total)
 
     if not sets:
@@ -1102,10 +1388,10 @@ def devoluciones_update():
 
     params.append(did)
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute(f"UPDATE devoluciones_cab SET {', '.join(sets)} WHERE id = ?", params)
-        conn.commit()
+        with conn:
+            conn.execute(_update_sql("devoluciones_cab", tuple(sets)), params)
         flash('Devolución actualizada.')
     finally:
         conn.close()
@@ -1121,22 +1407,21 @@ def devoluciones_delete():
         flash('ID inválido.')
         return redirect(url_for('devoluciones'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         # Revertir stock previamente repuesto
         items = conn.execute(
             "SELECT producto_id, cantidad FROM devoluciones_items WHERE devolucion_id = ?",
             (did,)
         ).fetchall()
-        for it in items:
-            conn.execute(
+        with conn:
+            conn.executemany(
                 "UPDATE productos SET cantidad = cantidad - ? WHERE id = ?",
-                (int(it['cantidad'] or 0), int(it['producto_id']))
+                [(int(it['cantidad'] or 0), int(it['producto_id'])) for it in items]
             )
 
-        conn.execute("DELETE FROM devoluciones_items WHERE devolucion_id = ?", (did,))
-        conn.execute("DELETE FROM devoluciones_cab   WHERE id = ?", (did,))
-        conn.commit()
+            conn.execute("DELETE FROM devoluciones_items WHERE devolucion_id = ?", (did,))
+            conn.execute("DELETE FROM devoluciones_cab   WHERE id = ?", (did,))
         flash('Devolución eliminada.')
     finally:
         conn.close()
@@ -1146,11 +1431,10 @@ def devoluciones_delete():
 # ----------------- Pagos a Vendedores -----------------
 @app.route('/pagos', methods=['GET', 'POST'])
 def pagos():
-    ensure_schema()
     if request.method == 'POST':
         # Esperamos: vendedor_id, medio_pago (efectivo/transferencia), monto, fecha y descripcion
         try:
-            vendedor_id = int(request.form.get('vendedor_id') or '0')
+            vendedor_id = _to_int(request.form.get('vendedor_id'))
         except Exception:
             vendedor_id = 0
         if vendedor_id <= 0:
@@ -1162,7 +1446,7 @@ def pagos():
             medio_pago = 'efectivo'
 
         try:
-            monto = float((request.form.get('monto') or '0').replace(',', '.'))
+            monto = _to_float(request.form.get('monto'))
         except Exception:
             flash('Monto inválido.')
             return redirect(url_for('pagos'))
@@ -1170,19 +1454,16 @@ def pagos():
             flash('El monto debe ser mayor a 0.')
             return redirect(url_for('pagos'))
 
-        fecha = (request.form.get('fecha') or '').strip() or datetime.now().strftime('%Y-%m-%d')
-        descripcion = (request.form.get('descripcion') or '').strip()
+        fecha, descripcion = _form_textos('fecha', 'descripcion')
+        fecha = fecha or None  # vacía: hoy (en el INSERT)
 
-        conn = get_db_connection()
+        conn = get_db()
         try:
-            # Aseguramos columna medio_pago (por si venías de schema viejo)
-            _add_col_if_missing(conn, "pagos_vendedores", "medio_pago TEXT")
-
-            conn.execute(
-                "INSERT INTO pagos_vendedores (vendedor_id, monto, fecha, descripcion, medio_pago) VALUES (?, ?, ?, ?, ?)",
-                (vendedor_id, monto, fecha, descripcion, medio_pago)
-            )
-            conn.commit()
+            with conn:
+                conn.execute(
+                    "INSERT INTO pagos_vendedores (vendedor_id, monto, fecha, descripcion, medio_pago) VALUES (?, ?, COALESCE(?, date('now','localtime')), ?, ?)",
+                    (vendedor_id, monto, fecha, descripcion, medio_pago)
+                )
             flash('Pago registrado.')
         finally:
             conn.close()
@@ -1190,17 +1471,16 @@ def pagos():
         return redirect(url_for('pagos'))
 
     # GET
-    conn = get_db_connection()
+    conn = get_db()
     try:
         vendedores = conn.execute("SELECT id, nombre FROM vendedores ORDER BY nombre").fetchall()
         pagos_list = conn.execute("""
             SELECT p.id, p.vendedor_id, v.nombre AS vendedor, p.medio_pago, p.monto, p.descripcion, p.fecha
               FROM pagos_vendedores p
               JOIN vendedores v ON v.id = p.vendedor_id
-          ORDER BY date(p.fecha) DESC, p.id DESC
+          ORDER BY p.fecha DESC, p.id DESC
         """).fetchall()
-        hoy = datetime.now().strftime('%Y-%m-%d')
-        return render_template('pagos.html', vendedores=vendedores, pagos=pagos_list, hoy=hoy)
+        return render_template('pagos.html', vendedores=vendedores, pagos=pagos_list)
     finally:
         conn.close()
 
@@ -1213,15 +1493,14 @@ def pagos_update():
         return redirect(url_for('pagos'))
 
     vendedor_id = request.form.get('vendedor_id')  # opcional
-    fecha = (request.form.get('fecha') or '').strip()
-    medio_pago = (request.form.get('medio_pago') or '').strip().lower()
-    descripcion = (request.form.get('descripcion') or '').strip()
+    fecha, medio_pago, descripcion = _form_textos('fecha', 'medio_pago', 'descripcion')
+    medio_pago = medio_pago.lower()
     monto_raw = request.form.get('monto')
 
     monto = None
     if monto_raw is not None:
         try:
-            monto = float((monto_raw or '0').replace(',', '.'))
+            monto = _to_float(monto_raw)
         except Exception:
             flash('Monto inválido.')
             return redirect(url_for('pagos'))
@@ -1230,26 +1509,26 @@ def pagos_update():
 
     if vendedor_id:
         try:
-            sets.append("vendedor_id = ?")
+            sets.append("vendedor_id")
             params.append(int(vendedor_id))
         except Exception:
             flash('Vendedor inválido.')
             return redirect(url_for('pagos'))
 
     if fecha:
-        sets.append("fecha = ?")
+        sets.append("fecha")
         params.append(fecha)
 
     if medio_pago in ('efectivo', 'transferencia'):
-        sets.append("medio_pago = ?")
+        sets.append("medio_pago")
         params.append(medio_pago)
 
     if descripcion is not None:
-        sets.append("descripcion = ?")
+        sets.append("descripcion")
         params.append(descripcion)
 
     if monto is not None:
-        sets.append("monto = ?")
+        sets.append("monto")
         params.append(monto)
 
     if not sets:
@@ -1258,10 +1537,10 @@ def pagos_update():
 
     params.append(pid)
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute(f"UPDATE pagos_vendedores SET {', '.join(sets)} WHERE id = ?", tuple(params))
-        conn.commit()
+        with conn:
+            conn.execute(_update_sql("pagos_vendedores", tuple(sets)), tuple(params))
         flash('Pago actualizado.')
     finally:
         conn.close()
@@ -1276,10 +1555,10 @@ def pagos_delete():
         flash('ID inválido.')
         return redirect(url_for('pagos'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute("DELETE FROM pagos_vendedores WHERE id = ?", (pid,))
-        conn.commit()
+        with conn:
+            conn.execute("DELETE FROM pagos_vendedores WHERE id = ?", (pid,))
         flash('Pago eliminado.')
     finally:
         conn.close()
@@ -1293,30 +1572,31 @@ def gastos_view():
     GET: renderiza la página con el listado.
     POST: crea un gasto y redirige a /gastos (GET).
     """
-    conn = get_db_connection()
+    conn = get_db()
     try:
         if request.method == 'POST':
             # Campos (tipo se usa como descripción visible)
             tipo = (request.form.get('tipo') or '').strip()
             # El front envía 'monto' como string decimal con punto (p.ej. "1234.56")
             try:
-                monto = float((request.form.get('monto') or '0').replace(',', '.'))
+                monto = _to_float(request.form.get('monto'))
             except Exception:
                 monto = 0.0
 
             if not tipo or monto <= 0:
                 flash('Completá descripción y un monto válido.')
             else:
-                conn.execute(
-                    'INSERT INTO gastos (tipo, monto, descripcion, fecha) VALUES (?, ?, ?, ?)',
-                    (tipo, monto, '', datetime.now().strftime('%Y-%m-%d'))
-                )
-                conn.commit()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO gastos (tipo, monto, descripcion, fecha) VALUES (?, ?, ?, date('now','localtime'))",
+                        (tipo, monto, '')
+                    )
                 flash('Gasto registrado exitosamente!')
                 return redirect(url_for('gastos'))  # sólo después de crear
 
         # GET (o POST inválido que cae a render)
-        gastos_list = conn.execute('SELECT * FROM gastos ORDER BY date(fecha) DESC, id DESC').fetchall()
+        # solo lo que muestra gastos.html (descripcion no se lista)
+        gastos_list = conn.execute('SELECT id, tipo, monto, fecha FROM gastos ORDER BY fecha DESC, id DESC').fetchall()
         return render_template('gastos.html', gastos=gastos_list)
 
     finally:
@@ -1338,7 +1618,7 @@ def gastos_update():
     monto = None
     if monto_raw is not None:
         try:
-            monto = float((monto_raw or '0').replace(',', '.'))
+            monto = _to_float(monto_raw)
         except Exception:
             flash('Monto inválido.')
             return redirect(url_for('gastos'))
@@ -1350,17 +1630,17 @@ def gastos_update():
     # Construimos UPDATE dinámico según lo que llegó
     sets, params = [], []
     if tipo:
-        sets.append('tipo = ?')
+        sets.append("tipo")
         params.append(tipo)
     if monto is not None:
-        sets.append('monto = ?')
+        sets.append("monto")
         params.append(monto)
     params.append(gid)
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute(f"UPDATE gastos SET {', '.join(sets)} WHERE id = ?", params)
-        conn.commit()
+        with conn:
+            conn.execute(_update_sql("gastos", tuple(sets)), params)
         flash('Gasto actualizado.')
     finally:
         conn.close()
@@ -1378,10 +1658,10 @@ def gastos_delete():
         flash('ID inválido.')
         return redirect(url_for('gastos'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute("DELETE FROM gastos WHERE id = ?", (gid,))
-        conn.commit()
+        with conn:
+            conn.execute("DELETE FROM gastos WHERE id = ?", (gid,))
         flash('Gasto eliminado.')
     finally:
         conn.close()
@@ -1389,35 +1669,83 @@ def gastos_delete():
     return redirect(url_for('gastos'))
 
 # ----------------- Inventario -----------------
+# Filtros opcionales (marca exacta / texto en nombre o marca): las variantes de
+# cada SELECT se arman una vez al importar; el texto SQL por variante es siempre
+# el mismo, así el cache de statements de la conexión no vuelve a compilarlo.
+# El texto se busca en productos_fts (trigram: subcadena sin distinguir mayúsculas,
+# igual que el LIKE) y con LIKE cuando no se puede: q de menos de 3 caracteres
+# (trigram no indexa menos), q con comodines de LIKE, o SQLite sin FTS5.
+_INV_FILTROS_Q = {
+    None: None,
+    "like": "(p.nombre LIKE ? OR p.marca LIKE ?)",
+    "fts": "p.id IN (SELECT rowid FROM productos_fts WHERE productos_fts MATCH ?)",
+}
+
+def _inventario_sqls(select, order_by):
+    sqls = {}
+    for con_marca in (False, True):
+        for modo_q, filtro_q in _INV_FILTROS_Q.items():
+            where = ["1=1"]
+            if con_marca:
+                where.append("p.marca = ?")
+            if filtro_q:
+                where.append(filtro_q)
+            sqls[con_marca, modo_q] = f"{select}\n WHERE {' AND '.join(where)}\n ORDER BY {order_by}"
+    return sqls
+
+def _filtro_inventario(marca, q):
+    """(clave de variante, params) para los SQL de _inventario_sqls()."""
+    params = []
+    if marca:
+        params.append(marca)
+    modo_q = None
+    if q:
+        if _INV_FTS and len(q) >= 3 and '%' not in q and '_' not in q:
+            modo_q = "fts"
+            params.append('"' + q.replace('"', '""') + '"')  # frase literal
+        else:
+            modo_q = "like"
+            like = f"%{q}%"
+            params.extend([like, like])
+    return (bool(marca), modo_q), params
+
+_INV_VIEW_SQL = _inventario_sqls(
+    """SELECT p.id, p.nombre, p.marca, p.cantidad, p.cantidad_minima,
+              p.precio_compra, p.precio_venta
+         FROM productos p""",
+    "p.nombre",
+)
+_INV_EXPORT_SQL = _inventario_sqls(
+    """SELECT p.marca, p.nombre, p.precio_compra, p.precio_venta, p.cantidad, p.cantidad_minima
+         FROM productos p""",
+    "p.nombre",
+)
+_INV_PRINT_SQL = _inventario_sqls(
+    """SELECT p.marca, p.nombre, p.precio_venta
+         FROM productos p""",
+    "p.marca, p.nombre",
+)
+
 @app.route('/inventario', methods=['GET'], endpoint='inventario')
 def inventario_view():
     q = (request.args.get('q') or '').strip()
     marca_filtro = (request.args.get('marca') or '').strip()
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        where = ["1=1"]
-        params = []
-        if marca_filtro:
-            where.append("p.marca = ?")
-            params.append(marca_filtro)
-        if q:
-            where.append("(p.nombre LIKE ? OR p.marca LIKE ?)")
-            like = f"%{q}%"
-            params.extend([like, like])
-
-        productos = conn.execute(
-            f"""SELECT p.id, p.nombre, p.marca, p.cantidad, p.cantidad_minima,
-                         p.precio_compra, p.precio_venta
-                FROM productos p
-                WHERE {' AND '.join(where)}
-                ORDER BY p.nombre""",
-            params
-        ).fetchall()
-
-        marcas = conn.execute(
-            "SELECT DISTINCT marca FROM productos WHERE marca IS NOT NULL AND TRIM(marca) <> '' ORDER BY marca"
-        ).fetchall()
+        clave, params = _filtro_inventario(marca_filtro, q)
+        productos = conn.execute(_INV_VIEW_SQL[clave], params).fetchall()
+
+        # el combo de marcas es de todo el catálogo (no del filtro): sin filtros sale
+        # del mismo SELECT de productos; con filtros, del cache hasta la próxima escritura
+        if clave == (False, None):
+            # (marca,) como las filas del SELECT DISTINCT: el template lee m[0]
+            marcas = [(m,) for m in sorted({r["marca"] for r in productos
+                                            if r["marca"] is not None and r["marca"].strip(' ')})]
+        else:
+            marcas = _contexto_cacheado('marcas', lambda: conn.execute(
+                "SELECT DISTINCT marca FROM productos WHERE marca IS NOT NULL AND TRIM(marca) <> '' ORDER BY marca"
+            ).fetchall())
 
         productos_vencimiento = conn.execute(
             """SELECT ms.id AS mov_id, p.nombre, p.marca, ms.fecha_vencimiento, ms.cantidad_restante
@@ -1444,49 +1772,49 @@ def inventario_export():
     q = (request.args.get('q') or '').strip()
     marca = (request.args.get('marca') or '').strip()
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        where = ["1=1"]
-        params = []
-        if marca:
-            where.append("p.marca = ?")
-            params.append(marca)
-        if q:
-            where.append("(p.nombre LIKE ? OR p.marca LIKE ?)")
-            like = f"%{q}%"
-            params.extend([like, like])
-
-        rows = conn.execute(
-            f"""SELECT p.marca, p.nombre, p.precio_compra, p.precio_venta, p.cantidad, p.cantidad_minima
-                FROM productos p
-                WHERE {' AND '.join(where)}
-                ORDER BY p.nombre""",
-            params
-        ).fetchall()
+        clave, params = _filtro_inventario(marca, q)
+        with _raw_rows(conn):  # se recorren por posición
+            rows = conn.execute(_INV_EXPORT_SQL[clave], params).fetchall()
     finally:
         conn.close()
 
-    out = StringIO(newline="")
-    writer = csv.writer(out)
-    writer.writerow(["Marca", "Producto", "Precio Compra", "Precio Venta", "Margen %", "Cantidad", "Cant. mínima"])
-
-    for r in rows:
-        pc = float(r['precio_compra'] or 0)
-        pv = float(r['precio_venta'] or 0)
-        margen = ((pv - pc) / pc * 100.0) if pc else 0.0
-        writer.writerow([
-            r['marca'] or "",
-            r['nombre'] or "",
-            f"{pc:.2f}",
-            f"{pv:.2f}",
-            f"{margen:.1f}",
-            int(r['cantidad'] or 0),
-            int(r['cantidad_minima'] or 0),
-        ])
+    def _filas():
+        for marca_p, nombre, pc, pv, cantidad, cantidad_minima in rows:
+            pc = float(pc or 0)
+            pv = float(pv or 0)
+            margen = ((pv - pc) / pc * 100.0) if pc else 0.0
+            yield (
+                marca_p or "",
+                nombre or "",
+                f"{pc:.2f}",
+                f"{pv:.2f}",
+                f"{margen:.1f}",
+                int(cantidad or 0),
+                int(cantidad_minima or 0),
+            )
+
+    def _csv():
+        # se manda de a bloques: no se arma el CSV entero en memoria
+        out = StringIO(newline="")
+        writer = csv.writer(out)
+        writer.writerow(["Marca", "Producto", "Precio Compra", "Precio Venta", "Margen %", "Cantidad", "Cant. mínima"])
+        filas = _filas()
+        while True:
+            bloque = list(islice(filas, 500))
+            if not bloque:
+                break
+            writer.writerows(bloque)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+        if out.tell():
+            yield out.getvalue()
 
     filename = f"inventario_{datetime.now().strftime('%Y-%m-%d')}.csv"
     return Response(
-        out.getvalue(),
+        _csv(),
         mimetype="text/csv; charset=utf-8",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -1496,36 +1824,22 @@ def inventario_print():
     q = (request.args.get('q') or '').strip()
     marca = (request.args.get('marca') or '').strip()
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        where = ["1=1"]
-        params = []
-        if marca:
-            where.append("p.marca = ?")
-            params.append(marca)
-        if q:
-            where.append("(p.nombre LIKE ? OR p.marca LIKE ?)")
-            like = f"%{q}%"
-            params.extend([like, like])
-
-        rows = conn.execute(
-            f"""SELECT p.marca, p.nombre, p.precio_venta
-                  FROM productos p
-                 WHERE {' AND '.join(where)}
-              ORDER BY p.marca, p.nombre""",
-            params
-        ).fetchall()
+        clave, params = _filtro_inventario(marca, q)
+        rows = conn.execute(_INV_PRINT_SQL[clave], params).fetchall()
 
         # Convertimos sqlite3.Row -> dict para el generador de PDF
         productos = [dict(r) for r in rows]
     finally:
         conn.close()
 
-    # Generar PDF y enviarlo
-    filename = generate_price_list_pdf(
+    # Generar PDF (en el pool, para acotar cuántos corren a la vez) y enviarlo
+    filename = _PDF_EXEC.submit(
+        generate_price_list_pdf,
         productos,
         fecha=datetime.now().strftime("%Y-%m-%d %H:%M")
-    )
+    ).result()
     return send_file(filename, as_attachment=True)
 
 # ----------------- Vendedores -----------------
@@ -1536,7 +1850,7 @@ def vendedores_view():
         telefono = request.form.get('telefono', '').strip()
         email = request.form.get('email', '').strip()
         try:
-            comision = float((request.form.get('comision', '0') or '0').replace(',', '.'))
+            comision = _to_float(request.form.get('comision'))
         except (TypeError, ValueError):
             flash('Comisión inválida.')
             return redirect(url_for('vendedores'))
@@ -1545,28 +1859,32 @@ def vendedores_view():
             flash('Ingresá el nombre del vendedor.')
             return redirect(url_for('vendedores'))
 
-        conn = get_db_connection()
+        conn = get_db()
         try:
-            ensure_schema()
-            conn.execute(
-                'INSERT INTO vendedores (nombre, telefono, email, comision) VALUES (?, ?, ?, ?)',
-                (nombre, telefono, email, comision)
-            )
-            conn.commit()
+            with conn:
+                conn.execute(
+                    'INSERT INTO vendedores (nombre, telefono, email, comision) VALUES (?, ?, ?, ?)',
+                    (nombre, telefono, email, comision)
+                )
         finally:
             conn.close()
 
         flash('Vendedor agregado exitosamente!')
         return redirect(url_for('vendedores'))
 
-    conn = get_db_connection()
-    try:
-        vendedores_list = conn.execute('SELECT * FROM vendedores ORDER BY nombre').fetchall()
-        stats = _stats_por_vendedor(conn)
-    finally:
-        conn.close()
+    def listar():
+        conn = get_db()
+        try:
+            # los saldos agregan toda la historia: se recalculan solo tras una escritura (o el TTL)
+            vendedores_list, stats = _contexto_cacheado('vendedores', lambda: (
+                conn.execute('SELECT id, nombre, telefono, email, comision FROM vendedores ORDER BY nombre').fetchall(),
+                _stats_por_vendedor(conn),
+            ))
+        finally:
+            conn.close()
+        return render_template('vendedores.html', vendedores=vendedores_list, stats=stats)
 
-    return render_template('vendedores.html', vendedores=vendedores_list, stats=stats)
+    return _listado_cacheado('vendedores', listar)
 
 @app.route('/vendedores/update', methods=['POST'], endpoint='vendedores_update')
 def vendedores_update():
@@ -1576,11 +1894,9 @@ def vendedores_update():
         flash('ID de vendedor inválido.')
         return redirect(url_for('vendedores'))
 
-    nombre = (request.form.get('nombre') or '').strip()
-    telefono = (request.form.get('telefono') or '').strip()
-    email = (request.form.get('email') or '').strip()
+    nombre, telefono, email = _form_textos('nombre', 'telefono', 'email')
     try:
-        comision = float((request.form.get('comision', '0') or '0').replace(',', '.'))
+        comision = _to_float(request.form.get('comision'))
     except Exception:
         comision = 0.0
 
@@ -1588,13 +1904,13 @@ def vendedores_update():
         flash('El nombre no puede estar vacío.')
         return redirect(url_for('vendedores'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        updated = conn.execute(
-            "UPDATE vendedores SET nombre=?, telefono=?, email=?, comision=? WHERE id=?",
-            (nombre, telefono, email, comision, vendedor_id)
-        )
-        conn.commit()
+        with conn:
+            updated = conn.execute(
+                "UPDATE vendedores SET nombre=?, telefono=?, email=?, comision=? WHERE id=?",
+                (nombre, telefono, email, comision, vendedor_id)
+            )
         if updated.rowcount:
             flash('Vendedor actualizado.')
         else:
@@ -1612,23 +1928,12 @@ def vendedores_delete():
         flash('ID de vendedor inválido.')
         return redirect(url_for('vendedores'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        try:
-            conn.execute("DELETE FROM comisiones_vendedor_marca WHERE vendedor_id=?", (vendedor_id,))
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("DELETE FROM pagos_vendedores WHERE vendedor_id=?", (vendedor_id,))
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("DELETE FROM bonificaciones WHERE vendedor_id=?", (vendedor_id,))
-        except sqlite3.OperationalError:
-            pass
-
-        deleted = conn.execute("DELETE FROM vendedores WHERE id=?", (vendedor_id,))
-        conn.commit()
+        # comisiones / pagos / bonificaciones del vendedor los borra el trigger
+        # vendedores_ad (ensure_schema), en el mismo statement
+        with conn:
+            deleted = conn.execute("DELETE FROM vendedores WHERE id=?", (vendedor_id,))
         if deleted.rowcount:
             flash('Vendedor eliminado.')
         else:
@@ -1643,7 +1948,7 @@ def vendedores_delete():
 def vendedores_comisiones_view():
     filtro_vendedor_id = (request.args.get('vendedor_id') or '').strip()
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
         vendedores_all = conn.execute("SELECT id, nombre FROM vendedores ORDER BY nombre").fetchall()
 
@@ -1681,7 +1986,7 @@ def vendedores_comisiones_add():
 
     marca = _norm_marca(request.form.get('marca'))
     try:
-        pct = float((request.form.get('comision_pct') or '0').replace(',', '.'))
+        pct = _to_float(request.form.get('comision_pct'))
     except Exception:
         pct = 0.0
 
@@ -1689,16 +1994,16 @@ def vendedores_comisiones_add():
         flash('Ingresá la marca.')
         return redirect(url_for('vendedores_comisiones', vendedor_id=vendedor_id))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute(
-            """INSERT INTO comisiones_vendedor_marca (vendedor_id, marca, comision_pct)
-               VALUES (?, ?, ?)
-               ON CONFLICT(vendedor_id, marca) DO UPDATE SET comision_pct=excluded.comision_pct
-            """,
-            (vendedor_id, marca, pct)
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                """INSERT INTO comisiones_vendedor_marca (vendedor_id, marca, comision_pct)
+                   VALUES (?, ?, ?)
+                   ON CONFLICT(vendedor_id, marca) DO UPDATE SET comision_pct=excluded.comision_pct
+                """,
+                (vendedor_id, marca, pct)
+            )
         flash('Comisión guardada.')
     finally:
         conn.close()
@@ -1709,15 +2014,15 @@ def vendedores_comisiones_add():
 def vendedores_comisiones_update():
     try:
         cid = int(request.form.get('id'))
-        pct = float((request.form.get('comision_pct') or '0').replace(',', '.'))
+        pct = _to_float(request.form.get('comision_pct'))
     except Exception:
         flash('Datos inválidos.')
         return redirect(url_for('vendedores_comisiones'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute("UPDATE comisiones_vendedor_marca SET comision_pct=? WHERE id=?", (pct, cid))
-        conn.commit()
+        with conn:
+            conn.execute("UPDATE comisiones_vendedor_marca SET comision_pct=? WHERE id=?", (pct, cid))
         flash('Comisión actualizada.')
     finally:
         conn.close()
@@ -1732,10 +2037,10 @@ def vendedores_comisiones_delete():
         flash('ID inválido.')
         return redirect(url_for('vendedores_comisiones'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute("DELETE FROM comisiones_vendedor_marca WHERE id=?", (cid,))
-        conn.commit()
+        with conn:
+            conn.execute("DELETE FROM comisiones_vendedor_marca WHERE id=?", (cid,))
         flash('Comisión eliminada.')
     finally:
         conn.close()
@@ -1745,23 +2050,15 @@ def vendedores_comisiones_delete():
 # ----------------- Proveedores -----------------
 @app.route('/proveedores', methods=['GET', 'POST'])
 def proveedores():
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        ensure_schema()
-
         if request.method == 'POST':
-            proveedor = (request.form.get('proveedor') or '').strip()
-            fecha = (request.form.get('fecha') or '').strip() or datetime.now().strftime('%Y-%m-%d')
+            proveedor, fecha = _form_textos('proveedor', 'fecha')
+            fecha = fecha or None  # vacía: hoy (en el INSERT)
             medio_pago = (request.form.get('medio_pago') or 'efectivo').strip().lower()
 
-            def to_float(x):
-                try:
-                    return float((x or '0').replace(',', '.'))
-                except Exception:
-                    return 0.0
-
-            monto_bruto = to_float(request.form.get('monto_bruto'))
-            comision_pct = to_float(request.form.get('comision_pct')) if medio_pago == 'cheque' else 0.0
+            monto_bruto = _to_float_o_cero(request.form.get('monto_bruto'))
+            comision_pct = _to_float_o_cero(request.form.get('comision_pct')) if medio_pago == 'cheque' else 0.0
             monto_neto = monto_bruto - (monto_bruto * comision_pct / 100.0)
             descripcion = (request.form.get('descripcion') or '').strip()
 
@@ -1769,39 +2066,46 @@ def proveedores():
                 flash('Ingresá el nombre del proveedor.')
                 return redirect(url_for('proveedores'))
 
-            conn.execute(
-                '''INSERT INTO pagos_proveedores
-                   (proveedor, medio_pago, monto_bruto, comision_pct, monto_neto, descripcion, fecha)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                (proveedor, medio_pago, monto_bruto, comision_pct, monto_neto, descripcion, fecha)
-            )
-
-            try:
-                conn.execute('UPDATE pagos_proveedores SET monto = monto_neto WHERE rowid = last_insert_rowid()')
-            except sqlite3.OperationalError:
-                pass
-
-            conn.commit()
+            # monto (columna vieja, la agrega ensure_schema) va en el mismo INSERT = monto_neto
+            with conn:
+                conn.execute(
+                    '''INSERT INTO pagos_proveedores
+                       (proveedor, medio_pago, monto_bruto, comision_pct, monto_neto, monto, descripcion, fecha)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, date('now','localtime')))''',
+                    (proveedor, medio_pago, monto_bruto, comision_pct, monto_neto, monto_neto, descripcion, fecha)
+                )
             flash('Pago a proveedor registrado exitosamente!')
             return redirect(url_for('proveedores'))
 
-        pagos = conn.execute(
-            'SELECT * FROM pagos_proveedores ORDER BY date(fecha) DESC, id DESC'
-        ).fetchall()
+        # SELECT *: el template lee casi todas las columnas y cuáles existen
+        # depende de si la tabla la creó init_db o ensure_schema, por eso usa
+        # .get con default: cada fila se pasa como dict (sqlite3.Row no tiene
+        # .get). Generador sobre el cursor, sin fetchall, como en bonificaciones.
+        pagos = (dict(r) for r in conn.execute(
+            'SELECT * FROM pagos_proveedores ORDER BY fecha DESC, id DESC'
+        ))
 
-        hoy = datetime.now().strftime('%Y-%m-%d')
-        return render_template('proveedores.html', pagos=pagos, hoy=hoy)
+        return render_template('proveedores.html', pagos=pagos)
 
     finally:
         conn.close()
 
 # ----------------- Bonificaciones -----------------
+# vendedores del form de bonificaciones, cada uno con sus comisiones por marca
+# ya agrupadas por SQLite: {"MARCA": pct, ...} ('{}' si no tiene)
+_BONIF_VENDEDORES_SQL = """
+    SELECT v.id, v.nombre, v.comision,
+           json_group_object(c.marca, c.comision_pct) FILTER (WHERE c.marca IS NOT NULL) AS marca_pct
+      FROM vendedores v
+      LEFT JOIN comisiones_vendedor_marca c ON c.vendedor_id = v.id
+     GROUP BY v.id
+     ORDER BY v.nombre
+"""
+
 @app.route('/bonificaciones', methods=['GET', 'POST'])
 def bonificaciones():
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        ensure_schema()
-
         if request.method == 'POST':
             # ---- POST: crear bonificación ----
             try:
@@ -1811,7 +2115,7 @@ def bonificaciones():
                 return redirect(url_for('bonificaciones'))
 
             try:
-                monto = float((request.form.get('monto') or '0').replace(',', '.'))
+                monto = _to_float(request.form.get('monto'))
             except Exception:
                 flash('Monto inválido.')
                 return redirect(url_for('bonificaciones'))
@@ -1820,38 +2124,42 @@ def bonificaciones():
                 flash('El monto debe ser mayor a 0.')
                 return redirect(url_for('bonificaciones'))
 
-            fecha = (request.form.get('fecha') or '').strip() or datetime.now().strftime('%Y-%m-%d')
-            descripcion = (request.form.get('descripcion') or '').strip()
+            fecha, descripcion = _form_textos('fecha', 'descripcion')
+            fecha = fecha or None  # vacía: hoy (en el INSERT)
 
-            conn.execute(
-                "INSERT INTO bonificaciones (vendedor_id, monto, fecha, descripcion) VALUES (?, ?, ?, ?)",
-                (vendedor_id, monto, fecha, descripcion)
-            )
-            conn.commit()
+            with conn:
+                conn.execute(
+                    "INSERT INTO bonificaciones (vendedor_id, monto, fecha, descripcion) VALUES (?, ?, COALESCE(?, date('now','localtime')), ?)",
+                    (vendedor_id, monto, fecha, descripcion)
+                )
             flash('Bonificación registrada.')
             return redirect(url_for('bonificaciones'))
 
         # ---- GET: listar ----
-        vendedores = conn.execute("SELECT id, nombre, comision FROM vendedores ORDER BY nombre").fetchall()
-        productos = conn.execute("SELECT id, nombre, marca, precio_venta FROM productos ORDER BY nombre").fetchall()
-        comisiones = conn.execute("SELECT vendedor_id, marca, comision_pct FROM comisiones_vendedor_marca").fetchall()
-        bonis = conn.execute(
-            """SELECT b.id, b.fecha, b.monto, b.descripcion,
-                      v.nombre AS vendedor, v.id AS vendedor_id
-               FROM bonificaciones b
-               JOIN vendedores v ON v.id = b.vendedor_id
-               ORDER BY date(b.fecha) DESC, b.id DESC"""
-        ).fetchall()
-        hoy = datetime.now().strftime('%Y-%m-%d')
+        def listar():
+            # datos de referencia del formulario (como en ventas/devoluciones): cacheados hasta la próxima escritura
+            vendedores, productos = _contexto_cacheado('bonificaciones', lambda: (
+                [{**v, 'marca_pct': json.loads(v['marca_pct'])}
+                 for v in map(dict, conn.execute(_BONIF_VENDEDORES_SQL))],
+                conn.execute("SELECT id, nombre, marca, precio_venta FROM productos ORDER BY nombre").fetchall(),
+            ))
+            # el cursor va directo al template: las filas se leen mientras se renderiza
+            bonis = conn.execute(
+                """SELECT b.id, b.fecha, b.monto, b.descripcion,
+                          v.nombre AS vendedor, v.id AS vendedor_id
+                   FROM bonificaciones b
+                   JOIN vendedores v ON v.id = b.vendedor_id
+                   ORDER BY b.fecha DESC, b.id DESC"""
+            )
 
-        return render_template(
-            'bonificaciones.html',
-            vendedores=vendedores,
-            productos=productos,
-            comisiones=comisiones,
-            bonificaciones=bonis,
-            hoy=hoy
-        )
+            return render_template(
+                'bonificaciones.html',
+                vendedores=vendedores,
+                productos=productos,
+                bonificaciones=bonis
+            )
+
+        return _listado_cacheado('bonificaciones', listar)
     finally:
         conn.close()
 
@@ -1859,10 +2167,8 @@ def bonificaciones():
 # Alias para formularios que apunten a bonificaciones_add (por tu dashboard)
 @app.route('/bonificaciones/add', methods=['POST'], endpoint='bonificaciones_add')
 def bonificaciones_add():
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        ensure_schema()
-
         try:
             vendedor_id = int(request.form.get('vendedor_id'))
         except Exception:
@@ -1870,7 +2176,7 @@ def bonificaciones_add():
             return redirect(url_for('bonificaciones'))
 
         try:
-            monto = float((request.form.get('monto') or '0').replace(',', '.'))
+            monto = _to_float(request.form.get('monto'))
         except Exception:
             flash('Monto inválido.')
             return redirect(url_for('bonificaciones'))
@@ -1879,14 +2185,14 @@ def bonificaciones_add():
             flash('El monto debe ser mayor a 0.')
             return redirect(url_for('bonificaciones'))
 
-        fecha = (request.form.get('fecha') or '').strip() or datetime.now().strftime('%Y-%m-%d')
-        descripcion = (request.form.get('descripcion') or '').strip()
+        fecha, descripcion = _form_textos('fecha', 'descripcion')
+        fecha = fecha or None  # vacía: hoy (en el INSERT)
 
-        conn.execute(
-            "INSERT INTO bonificaciones (vendedor_id, monto, fecha, descripcion) VALUES (?, ?, ?, ?)",
-            (vendedor_id, monto, fecha, descripcion)
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                "INSERT INTO bonificaciones (vendedor_id, monto, fecha, descripcion) VALUES (?, ?, COALESCE(?, date('now','localtime')), ?)",
+                (vendedor_id, monto, fecha, descripcion)
+            )
         flash('Bonificación registrada.')
     finally:
         conn.close()
@@ -1910,14 +2216,13 @@ def bonificaciones_update():
         return redirect(url_for('bonificaciones'))
 
     vendedor_id = request.form.get('vendedor_id')
-    fecha       = (request.form.get('fecha') or '').strip()
-    descripcion = (request.form.get('descripcion') or '').strip()
+    fecha, descripcion = _form_textos('fecha', 'descripcion')
     monto_raw   = request.form.get('monto')
 
     monto = None
     if monto_raw is not None:
         try:
-            monto = float((monto_raw or '0').replace(',', '.'))
+            monto = _to_float(monto_raw)
         except Exception:
             flash('Monto inválido.')
             return redirect(url_for('bonificaciones'))
@@ -1926,23 +2231,23 @@ def bonificaciones_update():
 
     if vendedor_id:
         try:
-            sets.append("vendedor_id=?")
+            sets.append("vendedor_id")
             params.append(int(vendedor_id))
         except Exception:
             flash('Vendedor inválido.')
             return redirect(url_for('bonificaciones'))
 
     if fecha:
-        sets.append("fecha=?")
+        sets.append("fecha")
         params.append(fecha)
 
     # descripción siempre la seteamos (permitimos vacío)
     if descripcion is not None:
-        sets.append("descripcion=?")
+        sets.append("descripcion")
         params.append(descripcion)
 
     if monto is not None:
-        sets.append("monto=?")
+        sets.append("monto")
         params.append(monto)
 
     if not sets:
@@ -1951,10 +2256,10 @@ def bonificaciones_update():
 
     params.append(bid)
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute(f"UPDATE bonificaciones SET {', '.join(sets)} WHERE id=?", tuple(params))
-        conn.commit()
+        with conn:
+            conn.execute(_update_sql("bonificaciones", tuple(sets)), tuple(params))
         flash('Bonificación actualizada.')
     finally:
         conn.close()
@@ -1970,10 +2275,10 @@ def bonificaciones_delete():
         flash('ID inválido.')
         return redirect(url_for('bonificaciones'))
 
-    conn = get_db_connection()
+    conn = get_db()
     try:
-        conn.execute("DELETE FROM bonificaciones WHERE id=?", (bid,))
-        conn.commit()
+        with conn:
+            conn.execute("DELETE FROM bonificaciones WHERE id=?", (bid,))
         flash('Bonificación eliminada.')
     finally:
         conn.close()
@@ -1986,23 +2291,12 @@ def stock():
     if request.method == 'POST':
         op = (request.form.get('op') or 'ingreso').strip().lower()
 
-        def to_int_from_input(val, field_name):
-            raw = (val or '').strip()
-            if not raw:
-                raise ValueError(f'Falta el campo: {field_name}')
-            try:
-                return int(float(raw.replace(',', '.')))
-            except Exception:
-                raise ValueError(f'Valor inválido en "{field_name}": {raw}')
-
-        conn = get_db_connection()
+        conn = get_db()
         try:
-            ensure_schema()
-
             if op == 'ingreso':
                 try:
-                    producto_id = to_int_from_input(request.form.get('producto_id'), 'Producto')
-                    cantidad    = to_int_from_input(request.form.get('cantidad'), 'Cantidad')
+                    producto_id = _to_int_campo(request.form.get('producto_id'), 'Producto')
+                    cantidad    = _to_int_campo(request.form.get('cantidad'), 'Cantidad')
                 except ValueError as e:
                     flash(str(e))
                     return redirect(url_for('stock'))
@@ -2015,26 +2309,27 @@ def stock():
                 proveedor_id = None
                 lote = None
 
-                conn.execute(
-                    'UPDATE productos SET cantidad = cantidad + ? WHERE id = ?',
-                    (cantidad, producto_id)
-                )
-                conn.execute(
-                    '''INSERT INTO movimientos_stock
-                       (producto_id, cantidad, cantidad_restante, tipo, proveedor_id, fecha_vencimiento, lote, fecha)
-                       VALUES (?, ?, ?, 'entrada', ?, ?, ?, ?)''',
-                    (producto_id, cantidad, cantidad, proveedor_id, fecha_vencimiento, lote, datetime.now().strftime('%Y-%m-%d'))
-                )
-                conn.commit()
+                # stock + lote en una sola transacción (un fsync, sin estado a medias)
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(
+                        'UPDATE productos SET cantidad = cantidad + ? WHERE id = ?',
+                        (cantidad, producto_id)
+                    )
+                    conn.execute(
+                        '''INSERT INTO movimientos_stock
+                           (producto_id, cantidad, cantidad_restante, tipo, proveedor_id, fecha_vencimiento, lote, fecha)
+                           VALUES (?, ?, ?, 'entrada', ?, ?, ?, date('now','localtime'))''',
+                        (producto_id, cantidad, cantidad, proveedor_id, fecha_vencimiento, lote)
+                    )
                 flash('Stock actualizado exitosamente!')
 
             elif op == 'nuevo':
-                nombre = (request.form.get('nombre') or '').strip()
-                marca  = (request.form.get('marca') or '').strip()
+                nombre, marca = _form_textos('nombre', 'marca')
                 try:
-                    precio_compra   = float((request.form.get('precio_compra') or '0').replace(',', '.'))
-                    precio_venta    = float((request.form.get('precio_venta')  or '0').replace(',', '.'))
-                    cantidad_minima = to_int_from_input(request.form.get('cantidad_minima', '0'), 'Cantidad mínima')
+                    precio_compra   = _to_float(request.form.get('precio_compra'))
+                    precio_venta    = _to_float(request.form.get('precio_venta'))
+                    cantidad_minima = _to_int_campo(request.form.get('cantidad_minima', '0'), 'Cantidad mínima')
                 except ValueError as e:
                     flash(str(e))
                     return redirect(url_for('stock'))
@@ -2043,27 +2338,26 @@ def stock():
                     flash('Completá marca y nombre del artículo.')
                     return redirect(url_for('stock'))
 
-                conn.execute(
-                    '''INSERT INTO productos (nombre, marca, precio_compra, precio_venta, cantidad, cantidad_minima)
-                       VALUES (?, ?, ?, ?, 0, ?)''',
-                    (nombre, marca, precio_compra, precio_venta, cantidad_minima)
-                )
-                conn.commit()
+                with conn:
+                    conn.execute(
+                        '''INSERT INTO productos (nombre, marca, precio_compra, precio_venta, cantidad, cantidad_minima)
+                           VALUES (?, ?, ?, ?, 0, ?)''',
+                        (nombre, marca, precio_compra, precio_venta, cantidad_minima)
+                    )
                 flash('Producto creado correctamente.')
 
             elif op == 'modificar':
                 try:
-                    producto_id_mod = to_int_from_input(request.form.get('producto_id_mod'), 'Producto a modificar')
+                    producto_id_mod = _to_int_campo(request.form.get('producto_id_mod'), 'Producto a modificar')
                 except ValueError as e:
                     flash(str(e))
                     return redirect(url_for('stock'))
 
-                nombre = (request.form.get('nombre') or '').strip()
-                marca  = (request.form.get('marca') or '').strip()
+                nombre, marca = _form_textos('nombre', 'marca')
                 try:
-                    precio_compra   = float((request.form.get('precio_compra') or '0').replace(',', '.'))
-                    precio_venta    = float((request.form.get('precio_venta')  or '0').replace(',', '.'))
-                    cantidad_minima = to_int_from_input(request.form.get('cantidad_minima', '0'), 'Cantidad mínima')
+                    precio_compra   = _to_float(request.form.get('precio_compra'))
+                    precio_venta    = _to_float(request.form.get('precio_venta'))
+                    cantidad_minima = _to_int_campo(request.form.get('cantidad_minima', '0'), 'Cantidad mínima')
                 except ValueError as e:
                     flash(str(e))
                     return redirect(url_for('stock'))
@@ -2072,19 +2366,19 @@ def stock():
                     flash('Completá marca y nombre del artículo.')
                     return redirect(url_for('stock'))
 
-                updated = conn.execute(
-                    '''UPDATE productos
-                       SET nombre = ?, marca = ?, precio_compra = ?, precio_venta = ?, cantidad_minima = ?
-                       WHERE id = ?''',
-                    (nombre, marca, precio_compra, precio_venta, cantidad_minima, producto_id_mod)
-                )
-                conn.commit()
+                with conn:
+                    updated = conn.execute(
+                        '''UPDATE productos
+                           SET nombre = ?, marca = ?, precio_compra = ?, precio_venta = ?, cantidad_minima = ?
+                           WHERE id = ?''',
+                        (nombre, marca, precio_compra, precio_venta, cantidad_minima, producto_id_mod)
+                    )
                 flash('Producto modificado correctamente.' if updated.rowcount else 'No se encontró el producto a modificar.')
 
             elif op == 'eliminar':
                 # id del producto a eliminar (desde inventario.html: producto_id_del)
                 try:
-                    producto_id_del = to_int_from_input(request.form.get('producto_id_del'), 'Producto a eliminar')
+                    producto_id_del = _to_int_campo(request.form.get('producto_id_del'), 'Producto a eliminar')
                 except ValueError as e:
                     flash(str(e))
                     return redirect(url_for('stock'))
@@ -2099,37 +2393,26 @@ def stock():
                     return redirect(url_for('stock'))
 
                 # Evitar borrar si el producto tiene referencias en ventas/devoluciones
-                refs = 0
-                try:
-                    c = conn.execute(
-                        "SELECT COUNT(*) FROM ventas_items WHERE producto_id = ?",
-                        (producto_id_del,)
-                    ).fetchone()
-                    refs += int((c[0] if isinstance(c, tuple) else c["COUNT(*)"]) if c is not None else 0)
-                except sqlite3.OperationalError:
-                    pass
-                try:
-                    c = conn.execute(
-                        "SELECT COUNT(*) FROM devoluciones_items WHERE producto_id = ?",
-                        (producto_id_del,)
-                    ).fetchone()
-                    refs += int((c[0] if isinstance(c, tuple) else c["COUNT(*)"]) if c is not None else 0)
-                except sqlite3.OperationalError:
-                    pass
+                # (EXISTS corta en la primera fila que encuentra por el índice de producto_id)
+                tiene_refs = conn.execute(
+                    "SELECT EXISTS(SELECT 1 FROM ventas_items WHERE producto_id = ?1)"
+                    "    OR EXISTS(SELECT 1 FROM devoluciones_items WHERE producto_id = ?1)",
+                    (producto_id_del,)
+                ).fetchone()[0]
 
-                if refs > 0:
+                if tiene_refs:
                     flash('No se puede eliminar: el producto tiene movimientos (ventas/devoluciones) asociados.')
                     return redirect(url_for('stock'))
 
-                # Borrar movimientos/lotes del producto (si existieran)
-                try:
-                    conn.execute("DELETE FROM movimientos_stock WHERE producto_id = ?", (producto_id_del,))
-                except sqlite3.OperationalError:
-                    pass
+                with conn:
+                    # Borrar movimientos/lotes del producto (si existieran)
+                    try:
+                        conn.execute("DELETE FROM movimientos_stock WHERE producto_id = ?", (producto_id_del,))
+                    except sqlite3.OperationalError:
+                        pass
 
-                # Borrar el producto
-                conn.execute("DELETE FROM productos WHERE id = ?", (producto_id_del,))
-                conn.commit()
+                    # Borrar el producto
+                    conn.execute("DELETE FROM productos WHERE id = ?", (producto_id_del,))
                 flash('Producto eliminado correctamente.')
 
             else:
@@ -2141,8 +2424,7 @@ def stock():
         return redirect(url_for('stock'))
 
     # GET
-    ensure_schema()
-    conn = get_db_connection()
+    conn = get_db()
     try:
         productos = conn.execute(
             'SELECT id, nombre, marca, precio_compra, precio_venta FROM productos ORDER BY nombre'
@@ -2156,6 +2438,17 @@ def stock():
 @app.route('/descargar_factura/<int:venta_id>')
 def descargar_factura(venta_id):
     filename = f"facturas/factura_{venta_id}.pdf"
+    pendiente = _factura_en_curso(venta_id)
+    if pendiente is not None:
+        pendiente.result()  # espera la que está en curso (y propaga si falló)
+    elif not os.path.exists(filename):
+        conn = get_db()
+        try:
+            row = conn.execute("SELECT factura_snapshot FROM ventas WHERE id = ?", (venta_id,)).fetchone()
+        finally:
+            conn.close()
+        if row and row["factura_snapshot"]:
+            _factura_en_curso(venta_id, json.loads(row["factura_snapshot"])).result()
     return send_file(filename, as_attachment=True)
 
 if __name__ == '__main__':
@@ -3,24 +3,28 @@ import sqlite3
 
 DB_PATH = "distribuidora.db"
 
-def add_column_if_missing(conn, table, col, coldef):
-    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+def add_column_if_missing(conn, table, col, coldef, cols):
+    # cols: set de columnas ya leído de la tabla; se actualiza si se agrega la columna
     if col not in cols:
         conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {coldef}")
+        cols.add(col)
 
 conn = sqlite3.connect(DB_PATH)
-c = conn.cursor()
 
-# Asegurar columnas nuevas en productos
-add_column_if_missing(conn, "productos", "precio_compra", "REAL")
-add_column_if_missing(conn, "productos", "precio_venta", "REAL")
-add_column_if_missing(conn, "productos", "cantidad_minima", "INTEGER DEFAULT 0")
+# Todo en una transacción (un solo fsync): si se corta a mitad no queda migrada a medias.
+# BEGIN explícito porque sqlite3 no abre transacción solo para los ALTER.
+with conn:
+    conn.execute("BEGIN")
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(productos)")}
 
-# Si existía una columna antigua 'precio', copiamos a precio_venta (solo si está vacía)
-cols = [r[1] for r in c.execute("PRAGMA table_info(productos)")]
-if "precio" in cols:
-    c.execute("UPDATE productos SET precio_venta = precio WHERE precio_venta IS NULL")
+    # Asegurar columnas nuevas en productos
+    add_column_if_missing(conn, "productos", "precio_compra", "REAL", cols)
+    add_column_if_missing(conn, "productos", "precio_venta", "REAL", cols)
+    add_column_if_missing(conn, "productos", "cantidad_minima", "INTEGER DEFAULT 0", cols)
+
+    # Si existía una columna antigua 'precio', copiamos a precio_venta (solo si está vacía)
+    if "precio" in cols:
+        conn.execute("UPDATE productos SET precio_venta = precio WHERE precio_venta IS NULL")
 
-conn.commit()
 conn.close()
 print("Migración OK")
@@ -1,38 +1,173 @@
 # pdf_generator.py
 from __future__ import annotations
 
+import io
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, KeepTogether
+    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, KeepTogether, PageBreak, LongTable
 )
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
 
+# formato es-AR: "1,234.50" -> "1.234,50" (intercambia ',' y '.' en una pasada)
+_SWAP = str.maketrans({",": ".", ".": ","})
+
+# Los precios se repiten mucho entre filas (y entre PDFs): el texto formateado
+# se cachea por valor. Los wrappers solo normalizan la entrada.
+@lru_cache(maxsize=4096)
+def _fmt_money_cached(v: float) -> str:
+    return "$ " + f"{v:,.2f}".translate(_SWAP)
+
+@lru_cache(maxsize=256)
+def _pct_cached(v: float) -> str:
+    return f"{v:.1f}%"
+
 def _fmt_money(n: float) -> str:
     try:
         v = float(n or 0)
     except Exception:
         v = 0.0
-    s = f"{v:,.2f}"
-    return "$ " + s.replace(",", "_").replace(".", ",").replace("_", ".")
+    return _fmt_money_cached(v)
 
 def _pct(n: float) -> str:
     try:
         v = float(n or 0)
     except Exception:
         v = 0.0
-    return f"{v:.1f}%"
+    return _pct_cached(v)
 
 def _ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
-
-def generate_invoice_pdf(
+def _write_pdf(filename: str, data: bytes):
+    # una sola escritura a un temporal del mismo directorio + rename atómico:
+    # quien lea filename (descargar_factura) nunca ve un PDF a medio escribir.
+    # open() normal (no mkstemp, que crea 0600): el PDF queda con los permisos
+    # de siempre según el umask. Nombre por proceso/hilo para que dos escrituras
+    # del mismo archivo no compartan el temporal.
+    tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:  # falló el open(): no hay temporal
+            pass
+        raise
+
+
+# Estilos: son solo datos y ReportLab no los modifica al armar el PDF, así que
+# se crean una vez al importar y todas las facturas/listas los comparten.
+_STYLES = getSampleStyleSheet()
+
+# factura
+_TITLE_STYLE = ParagraphStyle("title", parent=_STYLES["Title"], fontName="Helvetica-Bold",
+                              fontSize=18, leading=22, spaceAfter=2*mm, alignment=0)
+_SUBTITLE_STYLE = ParagraphStyle("subtitle", parent=_STYLES["Normal"], fontName="Helvetica",
+                                 fontSize=10.5, textColor=colors.grey, spaceAfter=1*mm)
+_HSMALL_STYLE = ParagraphStyle("hsmall", parent=_STYLES["Normal"], fontName="Helvetica-Bold",
+                               fontSize=10.5, spaceAfter=0)
+_NORMAL_STYLE = ParagraphStyle("normal", parent=_STYLES["Normal"], fontName="Helvetica",
+                               fontSize=9.5, leading=12)
+
+# lista de precios
+_H1_STYLE = ParagraphStyle("h1", parent=_STYLES["Title"], fontName="Helvetica-Bold", fontSize=18, leading=22, spaceAfter=2*mm)
+_SUB_STYLE = ParagraphStyle("sub", parent=_STYLES["Normal"], fontName="Helvetica", fontSize=10.5, textColor=colors.grey)
+_TH_STYLE  = ParagraphStyle("th",  parent=_STYLES["Normal"], fontName="Helvetica-Bold", fontSize=10)
+_TD_STYLE  = ParagraphStyle("td",  parent=_STYLES["Normal"], fontName="Helvetica", fontSize=9.5)
+
+# Medidas (en puntos) fijas de los documentos
+_MARGINS = dict(rightMargin=12*mm, leftMargin=12*mm, topMargin=12*mm, bottomMargin=14*mm)
+_HEAD_COL_WIDTHS = (35*mm, 35*mm)
+_ITEMS_COL_WIDTHS = (25*mm, 62*mm, 22*mm, 22*mm, 28*mm, 28*mm)
+_TOT_COL_WIDTHS = (80*mm, 30*mm)
+_RESUMEN_COL_WIDTHS = (60*mm, 35*mm)
+_PRICE_COL_WIDTHS = (40*mm, 95*mm, 30*mm)
+
+# Textos de encabezado de las tablas (los Paragraph se arman por documento:
+# el layout los modifica)
+_ITEM_HEADER_TEXTS = ("Marca", "Artículo", "Cantidad", "% Restado", "Precio unitario", "Precio final")
+_PRICE_HEADER_TEXTS = ("Marca", "Producto", "Precio")
+
+_HEAD_TBL_STYLE = TableStyle([
+    ("BOX", (0,0), (-1,-1), 0.25, colors.black),
+    ("INNERGRID", (0,0), (-1,-1), 0.25, colors.black),
+    ("BACKGROUND", (0,0), (-1,0), colors.whitesmoke),
+    ("ALIGN", (1,0), (-1,-1), "RIGHT"),
+    ("FONTNAME", (0,0), (-1,-1), "Helvetica"),
+    ("FONTSIZE", (0,0), (-1,-1), 9.5),
+    ("TOPPADDING", (0,0), (-1,-1), 3),
+    ("BOTTOMPADDING", (0,0), (-1,-1), 3),
+])
+
+_ITEMS_TBL_STYLE = TableStyle([
+    # Encabezado: negrita, fondo blanco y línea inferior negra
+    ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
+    ("FONTSIZE", (0,0), (-1,0), 10),
+    ("TEXTCOLOR", (0,0), (-1,0), colors.black),
+    ("BACKGROUND", (0,0), (-1,0), colors.white),
+    ("LINEBELOW", (0,0), (-1,0), 0.8, colors.black),
+
+    # Cuerpo
+    ("FONTNAME", (0,1), (-1,-1), "Helvetica"),
+    ("FONTSIZE", (0,1), (-1,-1), 9.5),
+    ("ALIGN", (2,1), (2,-1), "RIGHT"),
+    ("ALIGN", (3,1), (5,-1), "RIGHT"),
+
+    # Bordes/grilla negros
+    ("GRID", (0,0), (-1,-1), 0.25, colors.black),
+
+    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+    ("TOPPADDING", (0,0), (-1,-1), 4),
+    ("BOTTOMPADDING", (0,0), (-1,-1), 4),
+])
+
+_TOT_TBL_STYLE = TableStyle([
+    ("BOX", (0,0), (-1,-1), 0.6, colors.black),
+    ("BACKGROUND", (0,0), (0,0), colors.whitesmoke),
+    ("ALIGN", (0,0), (0,0), "RIGHT"),
+    ("ALIGN", (1,0), (1,0), "RIGHT"),
+    ("FONTNAME", (0,0), (-1,-1), "Helvetica-Bold"),
+    ("FONTSIZE", (0,0), (-1,-1), 10),
+    ("TOPPADDING", (0,0), (-1,-1), 4),
+    ("BOTTOMPADDING", (0,0), (-1,-1), 4),
+])
+
+# Helvetica y padding vertical 3 son los valores por defecto de Table: solo se
+# pisa lo que cambia (la fila "Saldo" en negrita)
+_RESUMEN_TBL_STYLE = TableStyle([
+    ("BOX", (0,0), (-1,-1), 0.4, colors.black),
+    ("INNERGRID", (0,0), (-1,-1), 0.25, colors.black),
+    ("BACKGROUND", (0,0), (-1,-2), colors.whitesmoke),
+    ("BACKGROUND", (0,-1), (-1,-1), colors.Color(0.95, 0.98, 1)),
+    ("FONTNAME", (0,-1), (-1,-1), "Helvetica-Bold"),
+    ("ALIGN", (1,0), (1,-1), "RIGHT"),
+    ("FONTSIZE", (0,0), (-1,-1), 9.5),
+])
+
+_PRICE_TBL_STYLE = TableStyle([
+    ("BOX", (0,0), (-1,-1), 0.6, colors.black),
+    ("GRID", (0,0), (-1,-1), 0.25, colors.grey),
+    ("BACKGROUND", (0,0), (-1,0), colors.white),   # fondo blanco (encabezados)
+    ("TEXTCOLOR", (0,0), (-1,0), colors.black),
+    ("ALIGN", (2,1), (2,-1), "RIGHT"),
+    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+    ("TOPPADDING", (0,0), (-1,-1), 4),
+    ("BOTTOMPADDING", (0,0), (-1,-1), 4),
+])
+
+
+def _invoice_flow(
     venta_id: int,
     vendedor_nombre: str,
     items: list[dict],
@@ -42,25 +177,9 @@ def generate_invoice_pdf(
     vendedor_id: int | None = None,     # compat
     alias_transferencia: str | None = None,  # aceptado pero NO mostrado
     stats: dict | None = None,
-) -> str:
-    _ensure_dir("facturas")
-    filename = os.path.join("facturas", f"factura_{venta_id}.pdf")
-
-    styles = getSampleStyleSheet()
-    title = ParagraphStyle("title", parent=styles["Title"], fontName="Helvetica-Bold",
-                           fontSize=18, leading=22, spaceAfter=2*mm, alignment=0)
-    subtitle = ParagraphStyle("subtitle", parent=styles["Normal"], fontName="Helvetica",
-                              fontSize=10.5, textColor=colors.grey, spaceAfter=1*mm)
-    hsmall = ParagraphStyle("hsmall", parent=styles["Normal"], fontName="Helvetica-Bold",
-                            fontSize=10.5, spaceAfter=0)
-    normal = ParagraphStyle("normal", parent=styles["Normal"], fontName="Helvetica",
-                            fontSize=9.5, leading=12)
-
-    doc = SimpleDocTemplate(
-        filename, pagesize=A4,
-        rightMargin=12*mm, leftMargin=12*mm, topMargin=12*mm, bottomMargin=14*mm,
-        title=f"Factura {venta_id}", author="DIARNEC DISTRIBUIDORA",
-    )
+) -> list:
+    """Flowables de una factura (sin el documento)."""
+    title, subtitle, hsmall, normal = _TITLE_STYLE, _SUBTITLE_STYLE, _HSMALL_STYLE, _NORMAL_STYLE
 
     flow = []
     # Encabezado
@@ -74,42 +193,28 @@ def generate_invoice_pdf(
     flow.append(Spacer(1, 3*mm))
 
     # Cabecera derecha con Nº / Fecha / Hora
-    fecha_str = fecha or datetime.now().strftime("%Y-%m-%d")
-    hora_str = datetime.now().strftime("%H:%M")
+    ahora = datetime.now()  # una sola lectura: fecha y hora del mismo instante
+    fecha_str = fecha or ahora.strftime("%Y-%m-%d")
+    hora_str = ahora.strftime("%H:%M")
     head_tbl = Table(
         [["Comprobante Nº", f"{venta_id}"],
          ["Fecha", fecha_str],
          ["Hora", hora_str]],
-        colWidths=[35*mm, 35*mm],
+        colWidths=_HEAD_COL_WIDTHS,
         hAlign="RIGHT",
     )
-    head_tbl.setStyle(TableStyle([
-        ("BOX", (0,0), (-1,-1), 0.25, colors.black),
-        ("INNERGRID", (0,0), (-1,-1), 0.25, colors.black),
-        ("BACKGROUND", (0,0), (-1,0), colors.whitesmoke),
-        ("ALIGN", (1,0), (-1,-1), "RIGHT"),
-        ("FONTNAME", (0,0), (-1,-1), "Helvetica"),
-        ("FONTSIZE", (0,0), (-1,-1), 9.5),
-        ("TOPPADDING", (0,0), (-1,-1), 3),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 3),
-    ]))
+    head_tbl.setStyle(_HEAD_TBL_STYLE)
     flow.append(head_tbl)
     flow.append(Spacer(1, 4*mm))
 
     # Tabla ítems — encabezado visible (negrita, fondo blanco, bordes negros)
-    headers = [
-        Paragraph("Marca", hsmall),
-        Paragraph("Artículo", hsmall),
-        Paragraph("Cantidad", hsmall),
-        Paragraph("% Restado", hsmall),
-        Paragraph("Precio unitario", hsmall),
-        Paragraph("Precio final", hsmall),
-    ]
-    data = [headers]
+    headers = [Paragraph(t, hsmall) for t in _ITEM_HEADER_TEXTS]
+    items = items or ()
+    data = [None] * (len(items) + 1)  # tamaño conocido: sin append/realloc
+    data[0] = headers
     total_mercaderia = 0.0
-    col_widths = [25*mm, 62*mm, 22*mm, 22*mm, 28*mm, 28*mm]
 
-    for it in items or []:
+    for i, it in enumerate(items, 1):
         marca = it.get("marca") or ""
         nombre = it.get("nombre") or it.get("producto") or ""
         qty = float(it.get("cantidad") or 0)
@@ -119,55 +224,28 @@ def generate_invoice_pdf(
         pu_final = pu * (1.0 - pct/100.0)
         subtotal = qty * pu_final
         total_mercaderia += subtotal
-        qty_str = f"{int(qty)}" if float(qty).is_integer() else f"{qty:g}"
+        # qty ya es float: enteros sin decimales (ni notación 1e+06), el resto con :g
+        qty_str = f"{qty:.0f}" if qty.is_integer() else f"{qty:g}"
 
-        data.append([
+        data[i] = [
             Paragraph(str(marca), normal),
             Paragraph(str(nombre), normal),
-            Paragraph(qty_str, normal),
-            Paragraph(_pct(pct), normal),
-            Paragraph(_fmt_money(pu), normal),
-            Paragraph(_fmt_money(pu_final), normal),
-        ])
-
-    table = Table(data, colWidths=col_widths, repeatRows=1)
-    table.setStyle(TableStyle([
-        # Encabezado: negrita, fondo blanco y línea inferior negra
-        ("FONTNAME", (0,0), (-1,0), "Helvetica-Bold"),
-        ("FONTSIZE", (0,0), (-1,0), 10),
-        ("TEXTCOLOR", (0,0), (-1,0), colors.black),
-        ("BACKGROUND", (0,0), (-1,0), colors.white),
-        ("LINEBELOW", (0,0), (-1,0), 0.8, colors.black),
-
-        # Cuerpo
-        ("FONTNAME", (0,1), (-1,-1), "Helvetica"),
-        ("FONTSIZE", (0,1), (-1,-1), 9.5),
-        ("ALIGN", (2,1), (2,-1), "RIGHT"),
-        ("ALIGN", (3,1), (5,-1), "RIGHT"),
-
-        # Bordes/grilla negros
-        ("GRID", (0,0), (-1,-1), 0.25, colors.black),
-
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("TOPPADDING", (0,0), (-1,-1), 4),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 4),
-    ]))
+            # números: texto plano (sin markup ni wrap), con la fuente del TableStyle
+            qty_str,
+            _pct(pct),
+            _fmt_money(pu),
+            _fmt_money(pu_final),
+        ]
+
+    table = Table(data, colWidths=_ITEMS_COL_WIDTHS, repeatRows=1)
+    table.setStyle(_ITEMS_TBL_STYLE)
     flow.append(table)
     flow.append(Spacer(1, 3*mm))
 
     # Total mercadería
     tot_tbl = Table([["Total mercadería retirada", _fmt_money(total_mercaderia)]],
-                    colWidths=[80*mm, 30*mm], hAlign="RIGHT")
-    tot_tbl.setStyle(TableStyle([
-        ("BOX", (0,0), (-1,-1), 0.6, colors.black),
-        ("BACKGROUND", (0,0), (0,0), colors.whitesmoke),
-        ("ALIGN", (0,0), (0,0), "RIGHT"),
-        ("ALIGN", (1,0), (1,0), "RIGHT"),
-        ("FONTNAME", (0,0), (-1,-1), "Helvetica-Bold"),
-        ("FONTSIZE", (0,0), (-1,-1), 10),
-        ("TOPPADDING", (0,0), (-1,-1), 4),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 4),
-    ]))
+                    colWidths=_TOT_COL_WIDTHS, hAlign="RIGHT")
+    tot_tbl.setStyle(_TOT_TBL_STYLE)
     flow.append(tot_tbl)
     flow.append(Spacer(1, 4*mm))
 
@@ -185,26 +263,103 @@ def generate_invoice_pdf(
              ["Bonificaciones", _fmt_money(bonif)],
              ["Pagos", _fmt_money(pagado)],
              ["Saldo", _fmt_money(saldo)]],
-            colWidths=[60*mm, 35*mm],
+            colWidths=_RESUMEN_COL_WIDTHS,
         )
-        resumen_tbl.setStyle(TableStyle([
-            ("BOX", (0,0), (-1,-1), 0.4, colors.black),
-            ("INNERGRID", (0,0), (-1,-1), 0.25, colors.black),
-            ("BACKGROUND", (0,0), (-1,-2), colors.whitesmoke),
-            ("BACKGROUND", (0,-1), (-1,-1), colors.Color(0.95, 0.98, 1)),
-            ("FONTNAME", (0,0), (-1,-1), "Helvetica"),
-            ("FONTNAME", (0,-1), (-1,-1), "Helvetica-Bold"),
-            ("ALIGN", (1,0), (1,-1), "RIGHT"),
-            ("FONTSIZE", (0,0), (-1,-1), 9.5),
-            ("TOPPADDING", (0,0), (-1,-1), 3),
-            ("BOTTOMPADDING", (0,0), (-1,-1), 3),
-        ]))
+        resumen_tbl.setStyle(_RESUMEN_TBL_STYLE)
         flow.append(Paragraph("Resumen del vendedor", hsmall))
         flow.append(KeepTogether(resumen_tbl))
 
+    return flow
+
+
+def _build_invoices_pdf(specs: list[dict]) -> bytes:
+    """
+    Varias facturas en un solo PDF, cada una desde una página nueva, con un
+    solo documento y un solo build. Devuelve los bytes del PDF.
+    specs: dicts con los argumentos de generate_invoice_pdf (venta_id, items, ...).
+    """
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buf, pagesize=A4,
+        **_MARGINS,
+        title=f"Factura {specs[0]['venta_id']}" if len(specs) == 1 else "Facturas",
+        author="DIARNEC DISTRIBUIDORA",
+    )
+
+    flow = []
+    for spec in specs:
+        if flow:
+            flow.append(PageBreak())
+        flow.extend(_invoice_flow(**spec))
+
     # Sin pie
     doc.build(flow)
+    return buf.getvalue()
+
+
+def generate_invoices_pdf_batch(specs: list[dict], out_path: str) -> str:
+    """Como _build_invoices_pdf, pero lo guarda en out_path y devuelve la ruta."""
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        _ensure_dir(out_dir)
+    _write_pdf(out_path, _build_invoices_pdf(specs))
+    return out_path
+
+
+def generate_invoice_pdf_bytes(
+    venta_id: int,
+    vendedor_nombre: str,
+    items: list[dict],
+    total_neto: float,
+    fecha: str,
+    vendedor_telefono: str | None = None,
+    vendedor_id: int | None = None,     # compat
+    alias_transferencia: str | None = None,  # aceptado pero NO mostrado
+    stats: dict | None = None,
+) -> bytes:
+    """La factura como bytes, sin pasar por disco (para mandarla directo)."""
+    return _build_invoices_pdf([dict(
+        venta_id=venta_id, vendedor_nombre=vendedor_nombre, items=items,
+        total_neto=total_neto, fecha=fecha, vendedor_telefono=vendedor_telefono,
+        vendedor_id=vendedor_id, alias_transferencia=alias_transferencia, stats=stats,
+    )])
+
+
+def generate_invoice_pdf(
+    venta_id: int,
+    vendedor_nombre: str,
+    items: list[dict],
+    total_neto: float,
+    fecha: str,
+    vendedor_telefono: str | None = None,
+    vendedor_id: int | None = None,     # compat
+    alias_transferencia: str | None = None,  # aceptado pero NO mostrado
+    stats: dict | None = None,
+) -> str:
+    _ensure_dir("facturas")
+    filename = os.path.join("facturas", f"factura_{venta_id}.pdf")
+    _write_pdf(filename, generate_invoice_pdf_bytes(
+        venta_id, vendedor_nombre, items, total_neto, fecha,
+        vendedor_telefono=vendedor_telefono, vendedor_id=vendedor_id,
+        alias_transferencia=alias_transferencia, stats=stats,
+    ))
     return filename
+
+
+def _generate_invoice_spec(spec: dict) -> str:
+    return generate_invoice_pdf(**spec)
+
+def generate_invoices_parallel(specs: list[dict], workers: int | None = None) -> list[str]:
+    """
+    Un PDF por spec (facturas/factura_<venta_id>.pdf), repartidos en procesos:
+    ReportLab es CPU puro y con hilos se pelea por el GIL.
+    workers: cantidad de procesos (None = os.cpu_count()).
+    Devuelve las rutas en el mismo orden que specs.
+    """
+    if len(specs) <= 1 or workers == 1:
+        return [_generate_invoice_spec(spec) for spec in specs]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_generate_invoice_spec, specs))
 # -------- lista de precios --------
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib.pagesizes import A4
@@ -221,18 +376,16 @@ def generate_price_list_pdf(productos, fecha=None, titulo="LISTA DE PRECIOS"):
     Devuelve la ruta del archivo generado.
     """
     _ensure_dir("reportes")
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ahora = datetime.now()
+    ts = ahora.strftime("%Y%m%d_%H%M%S")
     filename = os.path.join("reportes", f"lista_precios_{ts}.pdf")
 
-    styles = getSampleStyleSheet()
-    h1 = ParagraphStyle("h1", parent=styles["Title"], fontName="Helvetica-Bold", fontSize=18, leading=22, spaceAfter=2*mm)
-    sub = ParagraphStyle("sub", parent=styles["Normal"], fontName="Helvetica", fontSize=10.5, textColor=colors.grey)
-    th  = ParagraphStyle("th",  parent=styles["Normal"], fontName="Helvetica-Bold", fontSize=10)
-    td  = ParagraphStyle("td",  parent=styles["Normal"], fontName="Helvetica", fontSize=9.5)
+    h1, sub, th, td = _H1_STYLE, _SUB_STYLE, _TH_STYLE, _TD_STYLE
 
+    buf = io.BytesIO()
     doc = SimpleDocTemplate(
-        filename, pagesize=A4,
-        leftMargin=12*mm, rightMargin=12*mm, topMargin=12*mm, bottomMargin=14*mm,
+        buf, pagesize=A4,
+        **_MARGINS,
         title="Lista de precios", author="DIARNEC DISTRIBUIDORA"
     )
 
@@ -240,34 +393,162 @@ def generate_price_list_pdf(productos, fecha=None, titulo="LISTA DE PRECIOS"):
     flow.append(Paragraph("DIARNEC DISTRIBUIDORA", h1))
     flow.append(Paragraph("NECOCHEA Y ZONA", sub))
     flow.append(Paragraph(titulo, th))
-    flow.append(Paragraph(f"Fecha: {fecha or datetime.now().strftime('%Y-%m-%d %H:%M')}", sub))
+    flow.append(Paragraph(f"Fecha: {fecha or ahora.strftime('%Y-%m-%d %H:%M')}", sub))
     flow.append(Spacer(1, 4*mm))
 
-    # Encabezados
-    data = [
-        [Paragraph("Marca", th), Paragraph("Producto", th), Paragraph("Precio", th)]
-    ]
-
     # Ordenar por marca y producto
     rows = sorted(
         [(r.get("marca") or "", r.get("nombre") or "", float(r.get("precio_venta") or 0.0)) for r in productos],
         key=lambda x: (x[0].upper(), x[1].upper())
     )
-    for marca, nombre, precio in rows:
-        data.append([Paragraph(marca or "-", td), Paragraph(nombre, td), Paragraph(_fmt_money(precio), td)])
-
-    table = Table(data, colWidths=[40*mm, 95*mm, 30*mm], repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BOX", (0,0), (-1,-1), 0.6, colors.black),
-        ("GRID", (0,0), (-1,-1), 0.25, colors.grey),
-        ("BACKGROUND", (0,0), (-1,0), colors.white),   # fondo blanco (encabezados)
-        ("TEXTCOLOR", (0,0), (-1,0), colors.black),
-        ("ALIGN", (2,1), (2,-1), "RIGHT"),
-        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-        ("TOPPADDING", (0,0), (-1,-1), 4),
-        ("BOTTOMPADDING", (0,0), (-1,-1), 4),
-    ]))
+
+    # Encabezados (+ una fila por producto, lista ya de su tamaño)
+    data = [None] * (len(rows) + 1)
+    data[0] = [Paragraph(t, th) for t in _PRICE_HEADER_TEXTS]
+    # Marcas y precios se repiten mucho: un Paragraph por texto distinto en cada
+    # columna. Todas las celdas de una columna tienen el mismo ancho, así que el
+    # wrap da lo mismo y la misma instancia puede dibujarse en varias filas.
+    p_marca, p_precio = {}, {}
+    for i, (marca, nombre, precio) in enumerate(rows, 1):
+        pm = p_marca.get(marca)
+        if pm is None:
+            pm = p_marca[marca] = Paragraph(marca or "-", td)
+        pp = p_precio.get(precio)
+        if pp is None:
+            pp = p_precio[precio] = Paragraph(_fmt_money(precio), td)
+        data[i] = [pm, Paragraph(nombre, td), pp]
+
+    # LongTable: mismo resultado que Table, pero al partir por página solo mide
+    # las filas que entran, en vez de todas las que quedan
+    table = LongTable(data, colWidths=_PRICE_COL_WIDTHS, repeatRows=1)
+    table.setStyle(_PRICE_TBL_STYLE)
 
     flow.append(table)
     doc.build(flow)
+    _write_pdf(filename, buf.getvalue())
+    return filename
+
+
+# -------- lista de precios (canvas directo) --------
+from reportlab.pdfgen import canvas as _pdf_canvas
+from reportlab.lib.utils import simpleSplit
+
+_PRICE_PAD_X = 6     # LEFT/RIGHTPADDING por defecto de Table
+_PRICE_PAD_Y = 4     # TOP/BOTTOMPADDING de _PRICE_TBL_STYLE
+
+def generate_price_list_pdf_fast(productos, fecha=None, titulo="LISTA DE PRECIOS"):
+    """
+    Misma lista que generate_price_list_pdf, pero dibujada directo sobre el
+    canvas: sin Paragraph/Table ni el layout de platypus, cada fila se ubica
+    a mano (los textos largos se parten con simpleSplit). Pensada para
+    catálogos grandes, donde el layout es lo que más tarda.
+    Devuelve la ruta del archivo generado.
+    """
+    _ensure_dir("reportes")
+    ahora = datetime.now()
+    ts = ahora.strftime("%Y%m%d_%H%M%S")
+    filename = os.path.join("reportes", f"lista_precios_{ts}.pdf")
+
+    rows = sorted(
+        [(r.get("marca") or "", r.get("nombre") or "", float(r.get("precio_venta") or 0.0)) for r in productos],
+        key=lambda x: (x[0].upper(), x[1].upper())
+    )
+
+    page_w, page_h = A4
+    top = page_h - _MARGINS["topMargin"]
+    bottom = _MARGINS["bottomMargin"]
+    left = _MARGINS["leftMargin"]
+    frame_w = page_w - left - _MARGINS["rightMargin"]
+    w_marca, w_nombre, w_precio = _PRICE_COL_WIDTHS
+    table_w = w_marca + w_nombre + w_precio
+    # la Table de platypus va centrada en el frame
+    x0 = left + (frame_w - table_w) / 2
+    xs = (x0, x0 + w_marca, x0 + w_marca + w_nombre, x0 + table_w)
+    td_font, td_size, td_lead = _TD_STYLE.fontName, _TD_STYLE.fontSize, _TD_STYLE.leading
+    th_font, th_size, th_lead = _TH_STYLE.fontName, _TH_STYLE.fontSize, _TH_STYLE.leading
+
+    buf = io.BytesIO()
+    c = _pdf_canvas.Canvas(buf, pagesize=A4)
+    c.setTitle("Lista de precios")
+    c.setAuthor("DIARNEC DISTRIBUIDORA")
+
+    # Encabezado del documento (solo en la primera página)
+    y = top - _H1_STYLE.fontSize
+    c.setFont(_H1_STYLE.fontName, _H1_STYLE.fontSize)
+    c.drawCentredString(left + frame_w / 2, y, "DIARNEC DISTRIBUIDORA")
+    y -= _H1_STYLE.leading - _H1_STYLE.fontSize + _H1_STYLE.spaceAfter
+    for texto, st in (
+        ("NECOCHEA Y ZONA", _SUB_STYLE),
+        (titulo, _TH_STYLE),
+        (f"Fecha: {fecha or ahora.strftime('%Y-%m-%d %H:%M')}", _SUB_STYLE),
+    ):
+        c.setFillColor(st.textColor)
+        c.setFont(st.fontName, st.fontSize)
+        c.drawString(left, y - st.fontSize, texto)
+        y -= st.leading
+    c.setFillColor(colors.black)
+    y -= 4*mm
+
+    def cerrar_tabla(y_top, cortes):
+        # grilla + borde del tramo de tabla de esta página
+        c.setStrokeColor(colors.grey)
+        c.setLineWidth(0.25)
+        y_bot = cortes[-1]
+        for yc in cortes[:-1]:
+            c.line(xs[0], yc, xs[-1], yc)
+        for xc in xs[1:-1]:
+            c.line(xc, y_top, xc, y_bot)
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(0.6)
+        c.rect(xs[0], y_bot, table_w, y_top - y_bot)
+
+    def fila(y, celdas, font, size, lead):
+        # celdas: ((lineas, x, derecha), ...); devuelve el y de abajo de la fila
+        alto = max(len(lineas) for lineas, _, _ in celdas) * lead + 2 * _PRICE_PAD_Y
+        c.setFont(font, size)
+        for lineas, x, derecha in celdas:
+            # VALIGN MIDDLE: el bloque de líneas centrado en la celda
+            yl = y - (alto - len(lineas) * lead) / 2 - size
+            for ln in lineas:
+                if derecha:
+                    c.drawRightString(x, yl, ln)
+                else:
+                    c.drawString(x, yl, ln)
+                yl -= lead
+        return y - alto
+
+    head = tuple(([t], x + _PRICE_PAD_X, False) for t, x in zip(_PRICE_HEADER_TEXTS, xs))
+    avail_marca = w_marca - 2 * _PRICE_PAD_X
+    avail_nombre = w_nombre - 2 * _PRICE_PAD_X
+    # marcas y precios se repiten mucho: se parten/formatean una vez por valor
+    l_marca, l_precio = {}, {}
+
+    y_top = y
+    cortes = [fila(y, head, th_font, th_size, th_lead)]
+    for marca, nombre, precio in rows:
+        lm = l_marca.get(marca)
+        if lm is None:
+            lm = l_marca[marca] = simpleSplit(marca or "-", td_font, td_size, avail_marca)
+        lp = l_precio.get(precio)
+        if lp is None:
+            lp = l_precio[precio] = [_fmt_money(precio)]
+        ln = simpleSplit(nombre, td_font, td_size, avail_nombre)
+        alto = max(len(lm), len(ln), 1) * td_lead + 2 * _PRICE_PAD_Y
+        if cortes[-1] - alto < bottom:
+            # no entra: cerrar la página y repetir el encabezado de la tabla
+            cerrar_tabla(y_top, cortes)
+            c.showPage()
+            y_top = top
+            cortes = [fila(y_top, head, th_font, th_size, th_lead)]
+        cortes.append(fila(
+            cortes[-1],
+            ((lm, xs[0] + _PRICE_PAD_X, False),
+             (ln or [""], xs[1] + _PRICE_PAD_X, False),
+             (lp, xs[3] - _PRICE_PAD_X, True)),
+            td_font, td_size, td_lead,
+        ))
+    cerrar_tabla(y_top, cortes)
+    c.showPage()
+    c.save()
+    _write_pdf(filename, buf.getvalue())
     return filename
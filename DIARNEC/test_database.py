@@ -0,0 +1,46 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import database
+
+
+class ConexionesPorHiloTest(unittest.TestCase):
+    """
+    Cada hilo tiene su propia conexión: la de un hilo que ya terminó no
+    tiene que quedar abierta hasta el fin del proceso.
+    """
+    HILOS = 200
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(prefix="diarnec_test_")
+        self._db_path = database.DB_PATH
+        database.DB_PATH = os.path.join(self._dir, "test.db")
+
+    def tearDown(self):
+        database._cerrar_conexiones()
+        database.DB_PATH = self._db_path
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_conexiones_de_hilos_terminados_se_liberan(self):
+        def trabajo():
+            conn = database.get_db_connection()
+            try:
+                conn.execute("SELECT 1").fetchone()
+            finally:
+                conn.close()
+
+        for _ in range(self.HILOS):
+            hilo = threading.Thread(target=trabajo)
+            hilo.start()
+            hilo.join()
+        gc.collect()
+
+        self.assertLessEqual(len(database._abiertas), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()